@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Bankroll and risk of ruin by resampling per hand outcomes
+
+    python bankroll.py --seed 42 --save outcomes.npz
+    python bankroll.py --load outcomes.npz --bankroll 500 --max-bet 12
+
+The first stage plays card level trials flat betting one unit and counts
+the net result of every hand (blackjacks, doubles and splits included) by
+the true count the hand was bet at, as HLPlayer.set_wager reads it. The
+second stage turns those counts into a distribution of the result of one
+hand under a bet ramp and plays bankroll paths by drawing hands from it
+with NumPy, many paths at a time, until they are ruined, reach the target
+or run out of hands.
+
+Hands are drawn independently, so the way the count drifts through a shoe
+is not carried over, only how often each count comes up.
+"""
+import argparse, random
+import numpy as np
+from multiprocessing import Pool
+from blackjack import Shoe, CardsShowing, Player, Dealer
+import mc21
+
+COUNTS = np.arange(-10, 11) # true count buckets, the ends take the tails
+OUTCOMES = np.arange(-8, 9)/2.0 # net results of a one unit hand
+TRIALS = 64 # card level trials of the first stage
+HANDS = 16000 # hands per card level trial
+PATHS = 100000 # bankroll paths
+BLOCK = 10000 # paths played at a time per task
+STEP = 1000 # hands drawn at a time per path
+
+def counted(player_cls):
+    """ player_cls betting one unit and keeping the true count of its bet
+
+    the round's first set_wager is the bet; the calls double and split
+    make go to Player.set_wager, so a strategy that sizes its bets (such
+    as HLPlayer) still doubles and splits the one unit it bet
+    """
+    class Counted(player_cls):
+        def clear_hands(self):
+            player_cls.clear_hands(self)
+            self.wagered = False
+        def set_wager(self, wager):
+            if self.wagered:
+                Player.set_wager(self, wager)
+                return
+            self.wagered = True
+            self.bet_count = self.cards_showing.true_count()
+            self.wager = wager
+    Counted.__name__ = player_cls.__name__
+    return Counted
+
+def count_index(true_count):
+    return int(np.clip(round(true_count), COUNTS[0], COUNTS[-1])) - COUNTS[0]
+
+def outcome_counts(task):
+    """ returns hands counted by true count bucket and outcome, task is
+    (seed, trial index, hands, player class, decks) """
+    seed, index, num_hands, player_cls, decks = task
+    shoe = Shoe(decks, rng=random.Random(mc21.trial_seed(seed, index)))
+    cards_showing = CardsShowing(shoe)
+    dealer = Dealer(shoe, cards_showing)
+    player = counted(player_cls)(0, shoe, cards_showing, dealer)
+    counts = np.zeros((len(COUNTS), len(OUTCOMES)), dtype=np.int64)
+    for _ in range(num_hands):
+        balence = player.balence
+        mc21.play_round(dealer, [player])
+        outcome = int(round(2*(player.balence - balence))) + len(OUTCOMES)//2
+        if not 0 <= outcome < len(OUTCOMES):
+            raise ValueError('hand outcome out of range',
+                    player.balence - balence)
+        counts[count_index(player.bet_count), outcome] += 1
+    return counts
+
+def estimate(seed, trials=TRIALS, hands=HANDS, player_cls=mc21.PLAYER,
+        decks=mc21.DECKS, workers=None):
+    """ hand counts by true count bucket and outcome over seeded trials """
+    with Pool(workers) as pool:
+        return sum(pool.map(outcome_counts, [(seed, i, hands, player_cls,
+            decks) for i in range(trials)]))
+
+def hl_ramp(min_bet=1, max_bet=50):
+    """ bet per count bucket of HLPlayer: the true count in units, at
+    least min_bet and at most max_bet """
+    return np.clip(COUNTS, min_bet, max_bet).astype(float)
+
+def hand_distribution(counts, bets):
+    """ (values, probabilities) of the result of one hand betting
+    bets[bucket] at each true count bucket """
+    values = (bets[:, None]*OUTCOMES[None, :]).ravel()
+    probs = counts.ravel()/counts.sum()
+    values, inverse = np.unique(values, return_inverse=True)
+    return values, np.bincount(inverse.ravel(), weights=probs,
+            minlength=len(values))
+
+def alias_table(probs):
+    """ (keep, alias) of Walker's alias method: outcome k of a uniform draw
+    of the outcomes is kept with probability keep[k], otherwise it is
+    alias[k] """
+    n = len(probs)
+    keep = np.asarray(probs, dtype=float)*n/np.sum(probs)
+    alias = np.arange(n)
+    small = [k for k in range(n) if keep[k] < 1]
+    large = [k for k in range(n) if keep[k] >= 1]
+    while small and large:
+        k = small.pop()
+        j = large.pop()
+        alias[k] = j
+        keep[j] -= 1 - keep[k]
+        (small if keep[j] < 1 else large).append(j)
+    keep[small + large] = 1.0
+    return keep, alias
+
+def play_paths(task):
+    """ returns per path (ruined, hands to the target or -1, max drawdown,
+    final bankroll) of a block of bankroll paths, task is (values,
+    probabilities, paths, bankroll, target, hands, seed) """
+    values, probs, paths, bankroll, target, hands, seed = task
+    rng = np.random.default_rng(seed)
+    keep, alias = alias_table(probs)
+    kept, aliased = values, values[alias]
+    balence = np.full(paths, float(bankroll))
+    peak = balence.copy()
+    drawdown = np.zeros(paths)
+    ruined = np.zeros(paths, dtype=bool)
+    reached = np.full(paths, -1, dtype=np.int64)
+    alive = np.arange(paths)
+    for start in range(0, hands, STEP):
+        if not len(alive):
+            break
+        steps = min(STEP, hands - start)
+        x = rng.random((len(alive), steps))*len(values)
+        k = x.astype(np.intp)
+        x -= k
+        path = np.where(x < keep[k], kept[k], aliased[k]).cumsum(axis=1)
+        path += balence[alive, None]
+        high = np.maximum.accumulate(path, axis=1)
+        np.maximum(high, peak[alive, None], out=high)
+        # paths stop at the first hand that ruins them or reaches the target
+        stop = np.full(len(alive), steps)
+        for row in np.flatnonzero((path.min(axis=1) <= 0) |
+                (high[:, -1] >= target)):
+            stop[row] = np.flatnonzero((path[row] <= 0) |
+                    (path[row] >= target))[0]
+            path[row, stop[row] + 1:] = path[row, stop[row]]
+            high[row, stop[row] + 1:] = high[row, stop[row]]
+        drawdown[alive] = np.maximum(drawdown[alive],
+                (high - path).max(axis=1))
+        balence[alive] = path[:, -1]
+        peak[alive] = high[:, -1]
+        done = stop < steps
+        ruined[alive[done & (balence[alive] <= 0)]] = True
+        hit = done & (balence[alive] > 0)
+        reached[alive[hit]] = start + stop[hit] + 1
+        alive = alive[~done]
+    return ruined, reached, drawdown, balence
+
+def simulate(values, probs, seed, paths=PATHS, bankroll=1000.0, target=None,
+        hands=HANDS, workers=None):
+    """ per path results of play_paths over blocks of paths in a pool """
+    target = 2*bankroll if target is None else target
+    tasks = [(values, probs, min(BLOCK, paths - start), bankroll, target,
+        hands, mc21.trial_seed(seed, start//BLOCK))
+        for start in range(0, paths, BLOCK)]
+    with Pool(workers) as pool:
+        results = pool.map(play_paths, tasks)
+    return tuple(np.concatenate(parts) for parts in zip(*results))
+
+def report(values, probs, bankroll, ruined, reached, drawdown, balence):
+    mean = values @ probs
+    var = (values - mean)**2 @ probs
+    print('per hand: mean', str(round(mean, 4)), 'std',
+            str(round(np.sqrt(var), 4)), 'units')
+    if mean > 0:
+        print('risk of ruin (infinite play, diffusion):',
+                str(round(100*np.exp(-2*mean*bankroll/var), 4)) + '%')
+    print('risk of ruin:', str(round(100*ruined.mean(), 4)) + '%')
+    hit = reached >= 0
+    print('reached target:', str(round(100*hit.mean(), 4)) + '%', end='')
+    if hit.any():
+        print(', median', int(np.median(reached[hit])), 'hands')
+    else:
+        print()
+    print('max drawdown: mean', str(round(drawdown.mean(), 2)),
+            '95th percentile', str(round(np.percentile(drawdown, 95), 2)))
+    print('final bankroll: mean', str(round(balence.mean(), 2)))
+
+def main():
+    parser = argparse.ArgumentParser(description='bankroll and risk of ruin')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--player', choices=sorted(mc21.PLAYERS),
+            default=mc21.PLAYER.__name__,
+            help='strategy of the card level stage, bet flat')
+    parser.add_argument('--decks', type=int, default=mc21.DECKS)
+    parser.add_argument('--trials', type=int, default=TRIALS)
+    parser.add_argument('--hands', type=int, default=HANDS,
+            help='hands per card level trial and per bankroll path')
+    parser.add_argument('--save', help='store the outcome counts as .npz')
+    parser.add_argument('--load', help='skip the card level stage')
+    parser.add_argument('--paths', type=int, default=PATHS)
+    parser.add_argument('--bankroll', type=float, default=1000.0)
+    parser.add_argument('--target', type=float,
+            help='bankroll to stop at, twice the start by default')
+    parser.add_argument('--min-bet', type=float, default=1.0)
+    parser.add_argument('--max-bet', type=float, default=50.0)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    seed = np.random.SeedSequence(args.seed).entropy
+    print('seed:', seed)
+    if args.load:
+        counts = np.load(args.load)['counts']
+    else:
+        counts = estimate(seed, args.trials, args.hands,
+                mc21.PLAYERS[args.player], args.decks, args.workers)
+        if args.save:
+            np.savez(args.save, seed=str(seed), player=args.player,
+                    decks=args.decks, counts=counts, true_counts=COUNTS,
+                    outcomes=OUTCOMES)
+    hands = counts.sum(axis=1)
+    print('true count  hands    return')
+    for count, n, row in zip(COUNTS, hands, counts):
+        if n:
+            print('%+10d %7d %+8.4f' % (count, n, row @ OUTCOMES/n))
+    values, probs = hand_distribution(counts, hl_ramp(args.min_bet,
+        args.max_bet))
+    # seeded apart from the card level trials
+    path_seed = np.random.SeedSequence(seed, spawn_key=(1 << 32,))
+    results = simulate(values, probs, path_seed.generate_state(1)[0],
+            args.paths, args.bankroll, args.target, args.hands, args.workers)
+    report(values, probs, args.bankroll, *results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the simulation hot paths and of whole runs
+
+    python bench.py                               # run and print
+    python bench.py --save bench_baseline.json    # store a baseline
+    python bench.py --compare bench_baseline.json # check for regressions
+
+Micro benchmarks time single calls on prepared hands (calls/s), macro
+benchmarks play seeded trials (hands/s) and trace the peak memory per hand.
+Every number is the best of REPEAT runs.
+"""
+import argparse, contextlib, json, os, platform, random, subprocess
+import time, tracemalloc
+import mc21
+from blackjack import Shoe, CardsShowing, Player, Dealer, BasicStratPlayer
+from blackjack import TablePlayer, HLPlayer
+from vecsim import simulate_trials
+
+REPEAT = 5
+CALLS = 20000 # calls per micro benchmark
+HANDS = 4000 # hands per macro benchmark trial
+SLOWER = 0.9 # flag results below this fraction of the baseline
+
+def best_rate(setup, func, number):
+    """ best of REPEAT number/seconds of func(*setup()) """
+    best = 0.0
+    for _ in range(REPEAT):
+        args = setup()
+        start = time.perf_counter()
+        func(*args)
+        best = max(best, number/(time.perf_counter() - start))
+    return best
+
+def dealt(player_cls, number, decks=8, cards=2):
+    """ number (shoe, dealer, player) tables dealt cards each from one
+    seeded shoe """
+    shoe = Shoe(decks, rng=random.Random(0))
+    cards_showing = CardsShowing(shoe)
+    tables = []
+    for _ in range(number):
+        dealer = Dealer(shoe, cards_showing)
+        player = player_cls(0, shoe, cards_showing, dealer)
+        for _ in range(cards):
+            dealer.hit()
+            player.hit()
+        shoe.end_round()
+        tables.append((shoe, dealer, player))
+    return tables
+
+def bench_hit(n):
+    def run(tables):
+        for shoe, _, player in tables:
+            player.hit()
+            shoe.end_round()
+    return best_rate(lambda: (dealt(Player, n, cards=0),), run, n)
+
+def bench_best_hand_val(n):
+    def run(tables):
+        for _, _, player in tables:
+            player.best_hand_val()
+    return best_rate(lambda: (dealt(Player, n),), run, n)
+
+def bench_basic_move(n):
+    def run(tables):
+        for shoe, _, player in tables:
+            player.move()
+            shoe.end_round()
+    return best_rate(lambda: (dealt(BasicStratPlayer, n),), run, n)
+
+def bench_table_move(n):
+    def run(tables):
+        for shoe, _, player in tables:
+            player.move()
+            shoe.end_round()
+    return best_rate(lambda: (dealt(TablePlayer, n),), run, n)
+
+def bench_dealer_move(n):
+    def run(tables):
+        for shoe, dealer, _ in tables:
+            dealer.move()
+            shoe.end_round()
+    return best_rate(lambda: (dealt(Player, n),), run, n)
+
+def bench_reshuffle(n):
+    n = max(1, n//100)
+    def run(shoe):
+        for _ in range(n):
+            shoe.shuffle()
+    return best_rate(lambda: (Shoe(8, rng=random.Random(0)),), run, n)
+
+def bench_set_wager(n):
+    def run(tables):
+        for _, _, player in tables:
+            player.set_wager(1)
+    return best_rate(lambda: (dealt(HLPlayer, n),), run, n)
+
+MICRO = [
+    ('Player.hit', bench_hit),
+    ('Player.best_hand_val', bench_best_hand_val),
+    ('BasicStratPlayer.move', bench_basic_move),
+    ('TablePlayer.move', bench_table_move),
+    ('Dealer.move', bench_dealer_move),
+    ('Shoe.shuffle', bench_reshuffle),
+    ('HLPlayer.set_wager', bench_set_wager),
+]
+
+@contextlib.contextmanager
+def settings(**values):
+    """ sets mc21 module settings for the duration of a benchmark, pools
+    from mc21.worker_pool pass them on to their workers """
+    saved = dict((name, getattr(mc21, name)) for name in values)
+    for name, value in values.items():
+        setattr(mc21, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(mc21, name, value)
+
+def trial_rate(hands, player_cls, decks):
+    """ (hands/s, peak bytes per hand) of simulate_trial """
+    with settings(PLAYER=player_cls, DECKS=decks):
+        rate = best_rate(lambda: (), lambda: mc21.simulate_trial(hands,
+            seed=0), hands)
+        tracemalloc.start()
+        mc21.simulate_trial(hands, seed=0)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return rate, peak/hands
+
+def vector_rate(hands, trials=64):
+    rate = best_rate(lambda: (), lambda: simulate_trials(trials, hands,
+        seed=0), trials*hands)
+    tracemalloc.start()
+    simulate_trials(trials, hands, seed=0)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return rate, peak/(trials*hands)
+
+def pool_rate(hands, workers):
+    """ hands/s of 2 trials per worker played through a pool """
+    trials = 2*workers
+    with settings(PLAYER=TablePlayer, HANDS=hands, WORKERS=workers):
+        with mc21.worker_pool() as pool:
+            start = time.perf_counter()
+            pool.map(mc21.play_trial, [(0, i) for i in range(trials)])
+            return trials*hands/(time.perf_counter() - start), None
+
+def macro_cases(hands):
+    workers = os.cpu_count() or 1
+    cases = [('simulate_trial/' + name, lambda cls=cls: trial_rate(
+                hands//20 if cls is mc21.CCPlayer else hands, cls, 8))
+            for name, cls in sorted(mc21.PLAYERS.items())]
+    cases += [
+        ('simulate_trial/1 deck', lambda: trial_rate(hands, TablePlayer, 1)),
+        ('simulate_trial/8 decks', lambda: trial_rate(hands, TablePlayer, 8)),
+        ('vecsim.simulate_trials', lambda: vector_rate(hands)),
+        ('pool/1 worker', lambda: pool_rate(hands, 1)),
+    ]
+    if workers > 1:
+        cases.append(('pool/%d workers' % workers,
+            lambda: pool_rate(hands, workers)))
+    return cases
+
+def run(calls=CALLS, hands=HANDS, only=None):
+    """ returns {name: result} of the benchmarks whose name contains only """
+    results = {}
+    for name, bench in MICRO:
+        if only is None or only in name:
+            results[name] = dict(rate=bench(calls), unit='calls/s')
+            show(name, results[name])
+    for name, bench in macro_cases(hands):
+        if only is None or only in name:
+            rate, per_hand = bench()
+            results[name] = dict(rate=rate, unit='hands/s',
+                    bytes_per_hand=per_hand)
+            show(name, results[name])
+    return results
+
+def show(name, result, baseline=None):
+    line = '%-32s %12.0f %-8s' % (name, result['rate'], result['unit'])
+    if result.get('bytes_per_hand') is not None:
+        line += ' %8.1f B/hand' % result['bytes_per_hand']
+    if baseline is not None:
+        ratio = result['rate']/baseline['rate']
+        line += '  x%.2f' % ratio + (' SLOWER' if ratio < SLOWER else '')
+    print(line)
+
+def metadata():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short',
+            'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(commit=commit, python=platform.python_version(),
+            machine=platform.machine(), processor=platform.processor(),
+            cpus=os.cpu_count(), time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+def main():
+    parser = argparse.ArgumentParser(description='mc21 benchmarks')
+    parser.add_argument('--save', metavar='FILE',
+            help='store the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE',
+            help='compare the results with a JSON baseline')
+    parser.add_argument('--only', help='run benchmarks whose name has this')
+    parser.add_argument('--quick', action='store_true',
+            help='tenth of the calls and hands')
+    args = parser.parse_args()
+
+    scale = 10 if args.quick else 1
+    results = run(CALLS//scale, HANDS//scale, args.only)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('\ncompared with', args.compare, baseline['meta'])
+        for name, result in results.items():
+            if name in baseline['results']:
+                show(name, result, baseline['results'][name])
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(meta=metadata(), results=results), f, indent=1)
+
+if __name__ == '__main__':
+    main()
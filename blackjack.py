@@ -3,35 +3,162 @@
 Classes and functions for Blackjack simulations and game
 """
 from enum import IntEnum
-import random, os
+import functools, random
+import ev
+
+VALS = ['A', '2', '3', '4', '5', '6', '7', '8', '9', '10','J', 'Q', 'K']
+SUITS = ['Clubs', 'Heart', 'Diamond', 'Spades']
+
+# card counting systems as tags per card value
+HI_LO = dict(zip(VALS, (-1, 1, 1, 1, 1, 1, 0, 0, 0, -1, -1, -1, -1)))
+KO = dict(zip(VALS, (-1, 1, 1, 1, 1, 1, 1, 0, 0, -1, -1, -1, -1)))
+OMEGA_II = dict(zip(VALS, (0, 1, 1, 2, 2, 2, 1, 0, -1, -2, -2, -2, -2)))
+
+SYMBOLS = {'Clubs': '♣', 'Heart': '♥', 'Diamond': '♦', 'Spades': '♠'}
+
+ROUND_CARDS = 26 # cards a shuffle leaves at least between the table and the cut
 
 class Card(object):
-    def __init__(self, suit, val):
-        self.suit = suit
-        self.val = val
+    """ Immutable playing card, one shared instance per suit and value
+
+    Card(suit, val) returns the canonical card made at import, so shoes of
+    any size hold references to the same 52 objects. The hard (ace as 1)
+    and soft (ace as 11) values and the rank code of ev are precomputed.
+    """
+    __slots__ = ('suit', 'val', 'hard_val', 'soft_val', 'rank')
+    _cards = {}
+    def __new__(cls, suit, val):
+        return cls._cards[suit, val]
+    @classmethod
+    def _make(cls, suit, val):
+        card = object.__new__(cls)
+        hard_val = 1 if val == 'A' else 10 if val in ('J', 'Q', 'K') else \
+                int(val)
+        for name, value in (('suit', suit), ('val', val),
+                ('hard_val', hard_val), ('soft_val', 11 if val == 'A' else
+                    hard_val), ('rank', ev.rank_code(val))):
+            object.__setattr__(card, name, value)
+        cls._cards[suit, val] = card
+    def __setattr__(self, name, value):
+        raise AttributeError('cards are immutable')
+    def __reduce__(self):
+        return Card, (self.suit, self.val)
     def get_num_val(self, hard=False):
-        if self.val == 'Blank':
-            raise ValueError('Cannot evaluate card with value', self.val)
-        if self.val == 'A':
-            if hard:
-                return 1
-            else:
-                return 11
-        if self.val == 'J' or self.val == 'Q' or self.val == 'K':
-            return 10
-        return int(self.val)
+        return self.hard_val if hard else self.soft_val
     def __str__(self):
-        if self.val == 'Blank':
-            return 'BLANK'
-        if self.suit == 'Clubs':
-            suit = '♣'
-        elif self.suit == 'Heart':
-            suit = '♥'
-        elif self.suit == 'Diamond':
-            suit = '♦'
-        elif self.suit == 'Spades':
-            suit = '♠'
-        return str(self.val) + ' ' + suit
+        return str(self.val) + ' ' + SYMBOLS[self.suit]
+
+for _suit in SUITS:
+    for _val in VALS:
+        Card._make(_suit, _val)
+del _suit, _val
+
+class Shoe(object):
+    """ Multi deck shoe dealt by advancing an index over a shuffled buffer
+
+    The cut card is a position in the buffer: once it is reached the cards
+    that are not on the table are shuffled back in before the next deal.
+    penetration is the fraction of the shoe dealt before the cut card, which
+    is placed 8 +/- 4 cards in front of that point but never less than
+    ROUND_CARDS past the cards on the table, so a low penetration does not
+    reshuffle on every deal. rng (a random.Random)
+    drives the shuffles and the cut, the random module when not given.
+    """
+    def __init__(self, decks=8, penetration=1.0, rng=None):
+        if not 0 < penetration <= 1:
+            raise ValueError('penetration must be in (0, 1]', penetration)
+        self.decks = decks
+        self.penetration = penetration
+        self.rng = random if rng is None else rng
+        self.cards = [Card(suit, val)
+                for _ in range(decks) for val in VALS for suit in SUITS]
+        self.pos = 0
+        self.cut = 0
+        self.round_start = 0
+        self.shuffles = 0
+        self.shuffle()
+    def __len__(self):
+        """ number of cards left to deal """
+        return len(self.cards) - self.pos
+    def __iter__(self):
+        """ iterate over the cards left to deal """
+        return iter(self.cards[self.pos:])
+    def shuffle(self):
+        """ shuffle every card that is not on the table and place the cut """
+        in_play = self.cards[self.round_start:self.pos]
+        rest = self.cards[:self.round_start] + self.cards[self.pos:]
+        self.rng.shuffle(rest)
+        self.cards = in_play + rest
+        self.pos = len(in_play)
+        self.round_start = 0
+        self.shuffles += 1
+        cut = (int(len(self.cards)*self.penetration) - 8 +
+                self.rng.randint(-4, 4))
+        self.cut = min(max(cut, self.pos + ROUND_CARDS), len(self.cards))
+    def deal(self):
+        if self.pos >= self.cut:
+            self.shuffle()
+        card = self.cards[self.pos]
+        self.pos += 1
+        return card
+    def end_round(self):
+        """ cards dealt so far go to the discard tray """
+        self.round_start = self.pos
+    def getstate(self):
+        """ snapshot of the card order, position and rng to replay a round """
+        return (self.cards, self.pos, self.cut, self.round_start,
+                self.shuffles, self.rng.getstate())
+    def setstate(self, state):
+        (self.cards, self.pos, self.cut, self.round_start, self.shuffles,
+                rng_state) = state
+        self.rng.setstate(rng_state)
+
+class CardsShowing(object):
+    """ Running count of the cards shown at the table since the last shuffle
+
+    Stands in for the list of cards showing: append tags a card with the
+    count system in O(1) instead of storing it. The dealer's hole card is
+    held back by hide until reveal shows it. Once the shoe has been
+    reshuffled the count starts over from the cards of the round on the
+    table, which the shuffle keeps out of the new shoe.
+    """
+    def __init__(self, shoe, system=HI_LO):
+        self.shoe = shoe
+        self.system = system
+        self.shuffles = shoe.shuffles
+        self.running_count = 0
+        self.hole = None # the dealer's face down card
+    def append(self, card):
+        if self.shuffles != self.shoe.shuffles:
+            self.recount()
+            return
+        self.running_count += self.system[card.val]
+    def hide(self, card):
+        self.hole = card
+    def reveal(self):
+        """ shows the hole card """
+        card, self.hole = self.hole, None
+        if card is not None:
+            self.append(card)
+    def recount(self):
+        """ counts the cards dealt this round, the one being shown included,
+        as the count of a reshuffled shoe; the hole card is left out while
+        it is face down """
+        shoe = self.shoe
+        self.shuffles = shoe.shuffles
+        self.running_count = sum(self.system[card.val]
+                for card in shoe.cards[shoe.round_start:shoe.pos])
+        if self.hole is not None:
+            self.running_count -= self.system[self.hole.val]
+    def decks_remaining(self):
+        """ decks left to deal, never less than half a deck """
+        return max(len(self.shoe), 26)/52.0
+    def true_count(self):
+        return self.running_count/self.decks_remaining()
+    def getstate(self):
+        return self.shuffles, self.running_count, self.hole
+    def setstate(self, state):
+        self.shuffles, self.running_count, self.hole = state
 
 class Status(IntEnum):
     STAND = 0
@@ -39,42 +166,60 @@ class Status(IntEnum):
     SPLIT_1 = 2
     SPLIT_2 = 3
 
+class Action(IntEnum):
+    STAND = 0
+    HIT = 1
+    DOUBLE = 2
+    SPLIT = 3
+
+class HandClass(IntEnum):
+    HARD = 0 # no aces
+    SOFT = 1 # one ace
+    ACES = 2 # two or more aces, hand_val counts every one of them as 11
+    PAIR = 3 # two cards of the same value that can still be split
+
 class Player(object):
-    def __init__(self, balence, deck, used_cards, cards_showing):
-        self.hand = []
-        self.split_hand = []
-        self.status = Status.PLAY
+    """ hand totals are kept up to date on every hit, split and swap, so the
+    value of a hand is known without looking at its cards """
+    def __init__(self, balence, shoe, cards_showing, dealer=None):
+        self.clear_hands()
         self.wager = 0
         self.split_wager = 0
         self.balence = balence
-        self.deck = deck
-        self.used_cards = used_cards
+        self.shoe = shoe
         self.cards_showing = cards_showing
-    def reshuffle(self):
-        self.deck.extend(self.used_cards)
-        self.used_cards.clear()
-        random.shuffle(self.deck)
-        rand_index = 8 + random.randint(-4, 4)
-        blank_card = Card('Plastic', 'Blank')
-        self.deck.insert(rand_index, blank_card)
+        self.dealer = dealer
     def set_wager(self, wager):
         if self.status == Status.SPLIT_1:
             self.split_wager = wager
         else:
             self.wager = wager
+    def clear_hands(self):
+        self.hand = []
+        self.split_hand = []
+        self.status = Status.PLAY
+        self.hard_total = 0
+        self.num_aces = 0
+        self.split_hard_total = 0
+        self.split_num_aces = 0
+    def swap_hands(self):
+        self.hand, self.split_hand = self.split_hand, self.hand
+        self.hard_total, self.split_hard_total = (self.split_hard_total,
+                self.hard_total)
+        self.num_aces, self.split_num_aces = self.split_num_aces, self.num_aces
     def hit(self):
-        card = self.deck.pop()
-        if card.val == 'Blank':
-            self.reshuffle()
-            card = self.deck.pop()
+        card = self.shoe.deal()
         self.hand.append(card)
-        if not (isinstance(self, Dealer) and len(self.hand) == 2):
+        self.hard_total += card.hard_val
+        if card.val == 'A':
+            self.num_aces += 1
+        if isinstance(self, Dealer) and len(self.hand) == 2:
+            self.cards_showing.hide(card)
+        else:
             self.cards_showing.append(card)
     def stand(self):
         if self.status == Status.SPLIT_1:
-            tmp = self.hand
-            self.hand = self.split_hand
-            self.split_hand = tmp
+            self.swap_hands()
             self.status = Status.SPLIT_2
         else:
             self.status = Status.STAND
@@ -84,7 +229,12 @@ class Player(object):
         self.stand()
     def split(self):
         if len(self.hand) == 2 and len(self.split_hand) == 0:
-            self.split_hand.append(self.hand.pop())
+            card = self.hand.pop()
+            self.split_hand.append(card)
+            self.split_hard_total = card.hard_val
+            self.split_num_aces = 1 if card.val == 'A' else 0
+            self.hard_total -= self.split_hard_total
+            self.num_aces -= self.split_num_aces
             self.status = Status.SPLIT_1
             self.split_wager = self.wager
         else:
@@ -104,41 +254,44 @@ class Player(object):
         """ returns the value of hand
         if hard is true Aces are 1 otherwise Aces are 11
         """
-        val = 0
-        for card in self.hand:
-            val += card.get_num_val(hard=hard)
-        return val
+        if hard:
+            return self.hard_total
+        return self.hard_total + 10*self.num_aces
     def best_hand_val(self):
         """ returns most favorable value of hand """
-        if self.hand_val(hard=True) > 21:
+        if self.hard_total > 21:
             return 0
-        if self.hand_val() <= 21:
-            return self.hand_val()
-        return self.hand_val(hard=True)
+        soft_total = self.hard_total + 10*self.num_aces
+        if soft_total <= 21:
+            return soft_total
+        return self.hard_total
     def has_blackjack(self):
-        return self.hand_val() == 21 and len(self.hand) == 2
+        return (self.hard_total + 10*self.num_aces == 21 and
+                len(self.hand) == 2)
     def move(self):
         """ Implemented in child classes only """
         raise NotImplementedError
 
 class Dealer(Player):
-    def __init__(self, deck, used_cards, cards_showing):
-        self.hand = []
-        self.split_hand = []
-        self.status = Status.PLAY
-        self.deck = deck
-        self.used_cards = used_cards
+    def __init__(self, shoe, cards_showing):
+        self.clear_hands()
+        self.shoe = shoe
         self.cards_showing = cards_showing
+    def stand(self):
+        """ reveals the hole card """
+        self.cards_showing.reveal()
+        Player.stand(self)
     def move(self):
         """ Dealer hits until soft 17 """
-        if self.best_hand_val() >= 17 or self.best_hand_val() == 0:
+        best_hand_val = self.best_hand_val()
+        if best_hand_val >= 17 or best_hand_val == 0:
             self.stand()
         else:
             self.hit()
 
 class UIPlayer(Player):
-    def __init__(self, balence, deck, used_cards, cards_showing):
-        Player.__init__(self, balence, deck, used_cards, cards_showing)
+    def __init__(self, balence, shoe, cards_showing, dealer=None):
+        Player.__init__(self, balence, shoe, cards_showing, dealer)
     def move(self):
         s = input('S to stand, H to hit: ').lower()
         if s == 'h':
@@ -149,8 +302,8 @@ class UIPlayer(Player):
             self.stand()
 
 class SimplePlayer(Player):
-    def __init__(self, balence, deck, used_cards, cards_showing):
-        Player.__init__(self, balence, deck, used_cards, cards_showing)
+    def __init__(self, balence, shoe, cards_showing, dealer=None):
+        Player.__init__(self, balence, shoe, cards_showing, dealer)
     def move(self):
         if self.best_hand_val() >= 17:
             self.stand()
@@ -161,16 +314,10 @@ class SimplePlayer(Player):
 
 class BasicStratPlayer(Player):
     """ Strategy Board Player """
-    def __init__(self, balence, deck, used_cards, cards_showing, dealer):
-        Player.__init__(self, balence, deck, used_cards, cards_showing)
-        self.dealer = dealer
+    def __init__(self, balence, shoe, cards_showing, dealer):
+        Player.__init__(self, balence, shoe, cards_showing, dealer)
     def move(self):
-        # print('len(self.deck):\t', len(self.deck))
-        # print('len(self.used_cards):\t', len(self.used_cards))
-        # print('total:\t',
-        #         len(self.deck)+len(self.used_cards)+
-        #         len(self.hand)+len(self.dealer.hand))
-        dealer_showing = self.dealer.hand[0].get_num_val()
+        dealer_showing = self.dealer.hand[0].soft_val
         if self.best_hand_val() == 0:
             self.stand()
         # SPLITS
@@ -213,9 +360,6 @@ class BasicStratPlayer(Player):
         # SOFT
         elif (14 <= self.hand_val(hard=False) <= 21 and
                 self.hand_val(hard=False) !=  self.hand_val(hard=True)):
-            print('inf loop')
-            self.disp_hand()
-            print(self.status)
             soft_val = self.hand_val(hard=False)
             if soft_val >= 19:
                 self.stand()
@@ -276,47 +420,188 @@ class BasicStratPlayer(Player):
             else:
                 self.hit()
 
+class TablePlayer(Player):
+    """ Player executing a compiled strategy table
+
+    table[hand class][total][dealer upcard] is the Action to take, see
+    compile_table. Defaults to the basic strategy board.
+    """
+    def __init__(self, balence, shoe, cards_showing, dealer, table=None):
+        Player.__init__(self, balence, shoe, cards_showing, dealer)
+        self.table = compile_table(BasicStratPlayer) if table is None else table
+    def move(self):
+        hand = self.hand
+        if self.hard_total > 21:
+            self.stand()
+            return
+        if (len(hand) == 2 and hand[0].val == hand[1].val and
+                not self.split_hand and self.status == Status.PLAY):
+            row = self.table[HandClass.PAIR][hand[0].soft_val]
+        else:
+            row = self.table[min(self.num_aces, 2)][self.hard_total]
+        action = row[self.dealer.hand[0].soft_val]
+        if action == Action.STAND:
+            self.stand()
+        elif action == Action.HIT:
+            self.hit()
+        elif action == Action.DOUBLE:
+            self.double()
+        else:
+            self.split()
+
+class _StackedShoe(object):
+    """ deals a fixed list of cards in order """
+    def __init__(self, cards):
+        self.cards = list(cards)
+    def deal(self):
+        return self.cards.pop(0)
+
+def _spot_cards(total):
+    """ non ace card values adding up to total that never form a pair """
+    if total <= 10:
+        return [str(total)]
+    if total == 11:
+        return ['9', '2']
+    if total == 20:
+        return ['10', 'K']
+    if total < 20:
+        return ['10', str(total - 10)]
+    return ['10', '9'] + _spot_cards(total - 19)
+
+def _probe_cards(hand_class, total):
+    """ a hand of the given class and total, None if there is none """
+    if hand_class == HandClass.PAIR:
+        if not 2 <= total <= 11:
+            return None
+        val = 'A' if total == 11 else str(total)
+        return [val, val]
+    aces = min(hand_class, 2)
+    rest = total - aces
+    if rest == 0 and aces:
+        return ['A']*aces
+    if rest == 1 and hand_class == HandClass.ACES:
+        return ['A']*3
+    if rest < 2:
+        return None
+    return ['A']*aces + _spot_cards(rest)
+
+def _probe(player_cls, vals, up, status):
+    """ returns the Action player_cls.move takes holding vals against up """
+    up_val = 'A' if up == 11 else str(up)
+    dealer = Dealer(_StackedShoe([Card('Spades', up_val)]), [])
+    dealer.hit()
+    player = player_cls(0, _StackedShoe(Card('Spades', val) for val in vals),
+            [], dealer)
+    for _ in vals:
+        player.hit()
+    player.status = status
+    actions = []
+    player.stand = lambda: actions.append(Action.STAND)
+    player.hit = lambda: actions.append(Action.HIT)
+    player.double = lambda: actions.append(Action.DOUBLE)
+    player.split = lambda: actions.append(Action.SPLIT)
+    player.move()
+    return actions[0]
+
+@functools.lru_cache()
+def compile_table(player_cls):
+    """ returns the strategy of player_cls.move as a dense lookup table
+
+    table[hand class][total][dealer upcard] -> Action, with dealer upcards
+    2-11 (ace as 11). Totals are hard totals (aces as 1) except for pairs,
+    which are indexed by the value of one card with aces as 11. Busted hands
+    always stand and unreachable entries are STAND.
+
+    Every entry is filled in by running move on a representative hand, so
+    the table only holds strategies that decide on the hand class, total,
+    pair and upcard alone.
+    """
+    table = []
+    for hand_class in HandClass:
+        rows = []
+        for total in range(22):
+            vals = _probe_cards(hand_class, total)
+            if vals is None:
+                rows.append((Action.STAND,)*12)
+                continue
+            # hands that can not be split are probed as split hands
+            if (hand_class == HandClass.PAIR or
+                    (len(vals) > 1 and vals[0] != vals[1])):
+                status = Status.PLAY
+            else:
+                status = Status.SPLIT_2
+            rows.append((Action.STAND,)*2 + tuple(
+                _probe(player_cls, vals, up, status) for up in range(2, 12)))
+        table.append(tuple(rows))
+    return tuple(table)
+
 class CCPlayer(Player):
-    """ Card Counting Player """
-    def __init__(self, balence, deck, used_cards, cards_showing, dealer):
-        Player.__init__(balence, deck, used_cards, cards_showing)
-        self.dealer = dealer
+    """ Composition dependent player
+
+    Plays the move with the best expected return given the rank counts of
+    the cards it has not seen (see ev for the approximations) and bets one
+    unit per half percent of estimated advantage at the start of a round.
+    """
+    dealer_odds = staticmethod(ev.dealer_probs) # ev.bucket_probs for speed
+    def __init__(self, balence, shoe, cards_showing, dealer):
+        Player.__init__(self, balence, shoe, cards_showing, dealer)
+    def unseen(self):
+        """ rank counts of the cards left in the shoe and the hole card """
+        cards = list(self.shoe)
+        if self.dealer.status != Status.STAND:
+            cards.append(self.dealer.hand[1])
+        return ev.composition(cards)
     def expected_return(self):
         """ Return expected return of bet given the remaining deck
-        for each permutations of the remaining deck calculate expected return
-        and then calculate the average
+
+        estimated from the cards that were in the shoe when the round was
+        dealt, per move EVs are too slow to sum over every deal
         """
-        pass # TODO
+        return ev.estimate_ev(ev.composition(
+                self.shoe.cards[self.shoe.round_start:]))
     def move(self):
-        pass # TODO
+        if self.best_hand_val() == 0 or self.best_hand_val() == 21:
+            self.stand()
+            return
+        pair = None
+        if (len(self.hand) == 2 and self.hand[0].val == self.hand[1].val and
+                self.status == Status.PLAY and len(self.split_hand) == 0):
+            pair = self.hand[0].rank
+        evs = ev.move_evs(self.unseen(), self.hard_total, self.num_aces,
+                self.dealer.hand[0].rank,
+                self.status != Status.PLAY, pair, self.dealer_odds)
+        moves = (self.stand, self.hit, self.double, self.split)
+        best = max(range(len(moves)),
+                key=lambda i: -2 if evs[i] is None else evs[i])
+        moves[best]()
+    def double(self):
+        Player.set_wager(self, self.wager*2)
+        self.hit()
+        self.stand()
     def set_wager(self, wager):
-        pass # TODO
+        if self.status != Status.PLAY or len(self.split_hand):
+            Player.set_wager(self, wager)
+            return
+        bet = wager*self.expected_return()*200
+        if bet < 1:
+            bet = wager
+        if bet > 50:
+            bet = 50
+        self.wager = bet
 
-class HLPlayer(BasicStratPlayer):
-    """ player using high low counting system """
-    def __init__(self, balence, deck, used_cards, cards_showing, dealer):
-        BasicStratPlayer.__init__(
+class HLPlayer(TablePlayer):
+    """ player betting by the true count of the cards showing (Hi-Lo system
+    unless the table counts with another one) """
+    def __init__(self, balence, shoe, cards_showing, dealer):
+        TablePlayer.__init__(
                 self,
                 balence,
-                deck,
-                used_cards,
+                shoe,
                 cards_showing,
                 dealer
             )
     def set_wager(self, wager):
-        running_cnt = 0
-        for card in self.deck:
-            if card.val == 'Blank':
-                continue
-            val = card.get_num_val()
-            if 2 <= val <= 6:
-                running_cnt += 1
-            elif 10 <= val <= 11:
-                running_cnt -= 1
-        L = len(self.deck)
-        decks_remaining = L//26
-        decks_remaining = 1 if decks_remaining < 1 else decks_remaining
-        tru_cnt = running_cnt/float(decks_remaining)
+        tru_cnt = self.cards_showing.true_count()
         bet = wager*(tru_cnt)
         if bet < 1:
             bet = wager
@@ -331,25 +616,5 @@ def deal_cards(players):
 
 def clear_table(players): 
     for player in players:
-        player.status = Status.PLAY
-        while len(player.hand):
-            player.used_cards.append(player.hand.pop())
-        while len(player.split_hand):
-            player.used_cards.append(player.split_hand.pop())
-
-def print_UI(dealer, player1, dealer_move=False):
-    os.system('cls' if os.name == 'nt' else 'clear')
-    print('Balence:', player1.balence)
-    print('Wager:', player1.wager, '\n')
-    print(len(player1.deck))
-    for card in player1.deck:
-        print(card, ',', end=' ')
-    print()
-    if dealer_move:
-        print('Dealer showing:', dealer.best_hand_val())
-        dealer.disp_hand()
-        print()
-    else:
-        print('Dealer showing:\n'+str(dealer.hand[0]), '\n')
-    print('Your hand:', player1.best_hand_val())
-    player1.disp_hand()
+        player.clear_hands()
+        player.shoe.end_round()
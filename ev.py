@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Composition dependent expected values
+
+Expected returns of standing, hitting, doubling and splitting given the
+rank counts of the cards not seen yet, under the rules mc21 plays: the
+dealer stands on all 17s and always plays out, blackjack pays 3:2 and beats
+any other 21, a hand may be doubled at any time and split hands do not
+count blackjacks. Hands are valued like blackjack.Player.best_hand_val, so a
+hand holding two or more aces is always hard.
+
+The values are approximate: the dealer's outcomes are worked out once for
+the cards not seen at the decision and kept whatever the player draws
+after it, and each split hand is played as if the other one took no
+cards. The player's own draws are taken out of the composition exactly.
+
+A composition is a tuple of 10 rank counts, rank code 0 being the ace and
+9 every ten valued card. Sub-results are kept in LRU caches of CACHE_SIZE
+entries (see set_cache_size) keyed by composition, hand state and upcard
+(or the dealer outcomes it gives).
+"""
+import functools
+
+RANK_VALS = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10)
+# entries per cache: the hits come from within a decision, a CCPlayer trial
+# plays as fast with 1 << 10 as with 1 << 18 entries, which take 290 MB
+CACHE_SIZE = 1 << 12
+
+# change in expected return for each card of a rank taken out of one deck
+# (Griffin, The Theory of Blackjack) and the return off the top of the shoe
+EFFECTS_OF_REMOVAL = (-0.0059, 0.0038, 0.0044, 0.0056, 0.0069, 0.0046, 0.0028,
+        0.0, -0.0018, -0.0051)
+BASE_EV = -0.0085
+DECK = (4, 4, 4, 4, 4, 4, 4, 4, 4, 16)
+HI_LO_TAGS = (-1, 1, 1, 1, 1, 1, 0, 0, 0, -1)
+
+# dealer outcome indexes: bust, 17 to 21, blackjack
+BUST = 0
+BLACKJACK = 6
+
+def rank_code(val):
+    """ rank code of a card value from blackjack.VALS """
+    if val == 'A':
+        return 0
+    if val in ('10', 'J', 'Q', 'K'):
+        return 9
+    return int(val) - 1
+
+def composition(cards):
+    """ rank counts of an iterable of cards """
+    counts = [0]*10
+    for card in cards:
+        counts[card.rank] += 1
+    return tuple(counts)
+
+def hand_value(hard, aces):
+    """ best_hand_val of a hand: 0 when bust, soft only with a single ace """
+    if hard > 21:
+        return 0
+    if aces == 1 and hard <= 11:
+        return hard + 10
+    return hard
+
+def draw(comp, rank):
+    """ comp with one card of rank taken out """
+    return comp[:rank] + (comp[rank] - 1,) + comp[rank + 1:]
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def dealer_outcomes(comp, hard, aces):
+    """ outcome probabilities of a dealer hand past its first two cards """
+    out = [0.0]*7
+    if hard > 21:
+        out[BUST] = 1.0
+        return tuple(out)
+    value = hard + 10 if aces == 1 and hard <= 11 else hard
+    total = sum(comp)
+    if value >= 17 or not total:
+        out[max(value, 17) - 16] = 1.0
+        return tuple(out)
+    for rank, n in enumerate(comp):
+        if n:
+            p = n/total
+            sub = dealer_outcomes(draw(comp, rank), hard + RANK_VALS[rank],
+                    aces + 1 if rank == 0 and aces < 2 else aces)
+            out[0] += p*sub[0]
+            out[1] += p*sub[1]
+            out[2] += p*sub[2]
+            out[3] += p*sub[3]
+            out[4] += p*sub[4]
+            out[5] += p*sub[5]
+    return tuple(out)
+
+def dealer_probs(comp, upcard):
+    """ outcome probabilities (bust, 17..21, blackjack) of a dealer showing
+    upcard whose hole card is still among comp """
+    return _dealer_probs(comp, upcard)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _dealer_probs(comp, upcard):
+    total = sum(comp)
+    out = [0.0]*7
+    for rank, n in enumerate(comp):
+        if n:
+            p = n/total
+            hard = RANK_VALS[upcard] + RANK_VALS[rank]
+            aces = (upcard == 0) + (rank == 0)
+            if hand_value(hard, aces) == 21:
+                out[BLACKJACK] += p
+            else:
+                sub = dealer_outcomes(draw(comp, rank), hard, aces)
+                for i in range(BLACKJACK):
+                    out[i] += p*sub[i]
+    return tuple(out)
+
+def shoe(decks):
+    """ composition of a full shoe """
+    return tuple(n*decks for n in DECK)
+
+@functools.lru_cache(maxsize=8)
+def dealer_table(decks):
+    """ dealer_probs for each upcard dealt off the top of a full shoe """
+    comp = shoe(decks)
+    return tuple(dealer_probs(draw(comp, upcard), upcard)
+            for upcard in range(10))
+
+def true_count(comp, tags=HI_LO_TAGS):
+    """ true count of the cards dealt out of a shoe down to comp """
+    total = sum(comp)
+    if not total:
+        return 0.0
+    return -sum(tag*n for tag, n in zip(tags, comp))/(total/52.0)
+
+def count_bucket(comp):
+    """ (half decks left, true count) rounded to whole numbers """
+    total = sum(comp)
+    return max(1, int(round(total/26.0))), int(round(true_count(comp)))
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def bucket_composition(half_decks, count):
+    """ composition standing for every shoe in a count bucket: a shoe of
+    half_decks that has been short of low cards and long on aces and tens
+    by as many cards as it takes to reach the true count """
+    total = 26*half_decks
+    shift = count*total/104.0 # cards moved from low to high ranks
+    comp = []
+    for n, tag in zip(DECK, HI_LO_TAGS):
+        n = n*total/52.0
+        if tag > 0:
+            n -= shift/5
+        elif tag < 0:
+            n += shift*n/(total*5/13.0)
+        comp.append(max(0, int(round(n))))
+    return tuple(comp)
+
+def bucket_probs(comp, upcard):
+    """ dealer_probs of the count bucket comp falls in
+
+    Shoes with the same number of half decks left and the same rounded
+    (Hi-Lo) true count share one exact result, computed for
+    bucket_composition, so a repeated query is a dictionary lookup.
+    """
+    return _bucket_probs(count_bucket(comp), upcard)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _bucket_probs(bucket, upcard):
+    return dealer_probs(bucket_composition(*bucket), upcard)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def stand_evs(probs, split=False):
+    """ expected return of standing on each hand value 0 (bust) to 21
+    against a dealer with outcome probabilities probs """
+    evs = [-1.0]
+    for value in range(1, 22):
+        ev = probs[BUST]
+        for i in range(1, BLACKJACK):
+            dealer_value = 16 + i
+            ev += probs[i]*((value > dealer_value) - (value < dealer_value))
+        if not split or value < 21:
+            # split hands settle a dealer blackjack as a plain 21
+            ev -= probs[BLACKJACK]
+        evs.append(ev)
+    return tuple(evs)
+
+def stand_ev(hard, aces, probs, split=False, blackjack=False):
+    """ expected return per unit wagered of standing against a dealer with
+    outcome probabilities probs (see dealer_probs) """
+    if blackjack:
+        return 1.5*(1.0 - probs[BLACKJACK])
+    return stand_evs(probs, split)[hand_value(hard, aces)]
+
+def double_ev(comp, hard, aces, probs, split=False):
+    """ expected return per unit of the original wager of doubling """
+    evs = stand_evs(probs, split)
+    total = sum(comp)
+    ev = 0.0
+    for rank, n in enumerate(comp):
+        if n:
+            ev += n*evs[hand_value(hard + RANK_VALS[rank],
+                aces + 1 if rank == 0 and aces < 2 else aces)]
+    return 2*ev/total
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def hit_ev(comp, hard, aces, probs, split=False):
+    """ expected return of hitting once and then playing on optimally """
+    total = sum(comp)
+    ev = 0.0
+    for rank, n in enumerate(comp):
+        if n:
+            p = n/total
+            new_hard = hard + RANK_VALS[rank]
+            if new_hard > 21:
+                ev -= p
+            else:
+                ev += p*best_ev(draw(comp, rank), new_hard,
+                        min(aces + (rank == 0), 2), probs, split)
+    return ev
+
+def best_ev(comp, hard, aces, probs, split=False):
+    """ expected return of the best of standing, hitting and doubling """
+    ev = stand_ev(hard, aces, probs, split)
+    if hand_value(hard, aces) < 21 and sum(comp):
+        ev = max(ev, hit_ev(comp, hard, aces, probs, split),
+                double_ev(comp, hard, aces, probs, split))
+    return ev
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def split_ev(comp, rank, probs):
+    """ expected return per unit of the original wager of splitting a pair
+    of rank
+
+    each hand is played optimally from the pair card plus one card drawn
+    from comp; the cards the other hand takes are not removed
+    """
+    total = sum(comp)
+    ev = 0.0
+    for second, n in enumerate(comp):
+        if n:
+            ev += n/total*best_ev(draw(comp, second),
+                    RANK_VALS[rank] + RANK_VALS[second],
+                    (rank == 0) + (second == 0), probs, split=True)
+    return 2*ev
+
+def move_evs(comp, hard, aces, upcard, split=False, pair=None,
+        dealer=dealer_probs):
+    """ returns the expected returns of (stand, hit, double, split) for a
+    hand of hard total with aces, split is None unless the hand is a pair
+    of rank code pair
+
+    The dealer's outcomes are worked out once for comp, the cards not seen
+    at the decision, and used for every card the player may still draw.
+    This keeps a decision to a single dealer recursion; the player's draws
+    themselves are taken out of comp exactly. dealer gives the dealer's
+    outcomes, bucket_probs trades accuracy for speed.
+    """
+    probs = dealer(comp, upcard)
+    aces = min(aces, 2)
+    return (stand_ev(hard, aces, probs, split),
+            hit_ev(comp, hard, aces, probs, split),
+            double_ev(comp, hard, aces, probs, split),
+            None if pair is None else split_ev(comp, pair, probs))
+
+def estimate_ev(comp):
+    """ linear estimate of the expected return of a round dealt from comp,
+    BASE_EV shifted by the effects of removal of the ranks comp is short of
+    """
+    total = sum(comp)
+    if not total:
+        return BASE_EV
+    return BASE_EV + sum(eor*(n - 52.0*c/total)
+            for eor, n, c in zip(EFFECTS_OF_REMOVAL, DECK, comp))
+
+CACHED = ('dealer_outcomes', '_dealer_probs', 'bucket_composition',
+        '_bucket_probs', 'stand_evs', 'hit_ev', 'split_ev')
+
+def set_cache_size(size):
+    """ replaces the caches by empty ones of size entries each """
+    for name in CACHED:
+        globals()[name] = functools.lru_cache(maxsize=size)(
+                globals()[name].__wrapped__)
+
+def clear_caches():
+    dealer_table.cache_clear()
+    for name in CACHED:
+        globals()[name].cache_clear()
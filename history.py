@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Binary hand histories: a recorder, a memory mapped reader and a replay shoe
+
+Every hand played is one fixed width record of HAND, written in buffered
+chunks to a file per trial. A history is read back with numpy.memmap, so
+millions of hands can be filtered with array expressions without parsing:
+
+    hands = read_history('runs/h/000000.hands')
+    doubled = hands[(hands['flags'] & DOUBLE) != 0]
+    print(doubled['outcome'].mean())
+
+cards holds the index in blackjack.VALS of each card of the round in the
+order they were dealt: dealer, player, dealer (the hole card), player, then
+the player's draws and the dealer's last dealer_cards - 2. rank_codes turns
+them into the rank codes of ev. A ReplayShoe deals the recorded cards
+again, reshuffling where the shoe was reshuffled, so another strategy can
+be played on the same shoes; the number of decks is read off the first
+record, whose shoe_left is that of a full shoe.
+"""
+import os
+import numpy as np
+import ev
+from blackjack import VALS, Card, Shoe, Action
+
+MAX_CARDS = 28 # cards kept per round, longer rounds are TRUNCATED
+MAX_ACTIONS = 16 # player actions kept per round
+BUFFER_HANDS = 4096 # records buffered between writes
+VAL_CODES = dict((val, code) for code, val in enumerate(VALS))
+NONE = 255 # padding of cards and actions, shuffle_at of unshuffled rounds
+
+# flags
+SPLIT = 1
+DOUBLE = 2
+BLACKJACK = 4
+DEALER_BLACKJACK = 8
+TRUNCATED = 128
+
+HAND = np.dtype([
+    ('hand', '<u4'), # index in the trial
+    ('shoe', '<u2'), # shuffles of the shoe when the round was dealt
+    ('shoe_left', '<u2'), # cards left in the shoe when the round was dealt
+    ('running_count', '<i2'), # count of the cards showing before the deal
+    ('ncards', 'u1'),
+    ('shuffle_at', 'u1'), # cards dealt before a reshuffle within the round
+    ('dealer_cards', 'u1'),
+    ('nactions', 'u1'),
+    ('cards', 'u1', (MAX_CARDS,)), # VALS indexes
+    ('actions', 'u1', (MAX_ACTIONS,)), # Action values in the order taken
+    ('flags', 'u1'),
+    ('player_total', 'u1'), # best_hand_val, 0 when bust
+    ('split_total', 'u1'), # best_hand_val of the other split hand
+    ('dealer_total', 'u1'),
+    ('wager', '<f4'),
+    ('split_wager', '<f4'),
+    ('balence', '<f4'), # before the round
+    ('outcome', '<f4'), # change of the balence over the round
+])
+
+class EndOfHistory(Exception):
+    """ a ReplayShoe has dealt every recorded card """
+
+def trial_path(directory, index):
+    return os.path.join(directory, '%06d.hands' % index)
+
+def read_history(path):
+    """ read only record array of a history file, mapped not loaded """
+    return np.memmap(path, dtype=HAND, mode='r')
+
+def history_decks(hands):
+    """ decks of the shoe a history was recorded with """
+    if not len(hands):
+        raise ValueError('history holds no hands')
+    decks, rest = divmod(int(hands[0]['shoe_left']), 52)
+    if rest or not decks:
+        raise ValueError('history does not start on a full shoe')
+    return decks
+
+def rank_codes(cards):
+    """ ev.rank_code of recorded cards, padding left as NONE """
+    cards = np.asarray(cards)
+    return np.where(cards == NONE, NONE, np.minimum(cards, 9)).astype(np.uint8)
+
+class HandRecorder(object):
+    """ Writes a record of every round player one plays to path
+
+    simulate_trial calls start before and finish after each round, and
+    play_round calls played once the hands are played out; instrument
+    wraps the player's actions to log the ones move takes.
+    """
+    def __init__(self, path, shoe, cards_showing, buffer_hands=BUFFER_HANDS):
+        self.file = open(path, 'wb')
+        self.shoe = shoe
+        self.cards_showing = cards_showing
+        self.buffer = np.zeros(buffer_hands, dtype=HAND)
+        self.size = 0
+        self.hands = 0
+        self.actions = []
+        self.moving = False
+        self.acting = False
+    def instrument(self, player):
+        move = player.move
+        def moving():
+            self.moving = True
+            try:
+                return move()
+            finally:
+                self.moving = False
+        player.move = moving
+        for name, action in (('stand', Action.STAND), ('hit', Action.HIT),
+                ('double', Action.DOUBLE), ('split', Action.SPLIT)):
+            setattr(player, name, self.logged(getattr(player, name), action))
+    def logged(self, method, action):
+        """ method logging action when move calls it, not the calls the
+        action makes itself """
+        def wrapped(*args):
+            if not self.moving or self.acting:
+                return method(*args)
+            self.actions.append(action)
+            self.acting = True
+            try:
+                return method(*args)
+            finally:
+                self.acting = False
+        return wrapped
+    def start(self, player):
+        shoe = self.shoe
+        self.record = self.buffer[self.size]
+        self.record['hand'] = self.hands
+        self.record['shoe'] = shoe.shuffles
+        self.record['shoe_left'] = len(shoe)
+        self.record['running_count'] = self.cards_showing.running_count
+        self.record['balence'] = player.balence
+        self.round = shoe.pos, shoe.cut, shoe.shuffles
+        self.actions = []
+    def played(self, dealer, players):
+        player = players[0]
+        record = self.record
+        flags = 0
+        if len(player.split_hand):
+            flags |= SPLIT
+            record['split_total'] = ev.hand_value(player.split_hard_total,
+                    player.split_num_aces)
+        elif player.has_blackjack():
+            flags |= BLACKJACK
+        if Action.DOUBLE in self.actions:
+            flags |= DOUBLE
+        if dealer.has_blackjack():
+            flags |= DEALER_BLACKJACK
+        record['flags'] = flags
+        record['player_total'] = player.best_hand_val()
+        record['dealer_total'] = dealer.best_hand_val()
+        record['dealer_cards'] = len(dealer.hand)
+        record['wager'] = player.wager
+        record['split_wager'] = player.split_wager
+    def finish(self, player):
+        shoe = self.shoe
+        record = self.record
+        start, cut, shuffles = self.round
+        if shoe.shuffles == shuffles:
+            cards = shoe.cards[start:shoe.pos]
+            record['shuffle_at'] = NONE
+        else:
+            # the shoe reshuffles on the first deal at or past the cut
+            cards = shoe.cards[:shoe.pos]
+            record['shuffle_at'] = max(0, cut - start)
+        if len(cards) > MAX_CARDS or len(self.actions) > MAX_ACTIONS:
+            record['flags'] |= TRUNCATED
+        cards = cards[:MAX_CARDS]
+        actions = self.actions[:MAX_ACTIONS]
+        record['ncards'] = len(cards)
+        record['cards'] = NONE
+        record['cards'][:len(cards)] = [VAL_CODES[card.val] for card in cards]
+        record['nactions'] = len(actions)
+        record['actions'] = NONE
+        record['actions'][:len(actions)] = actions
+        record['outcome'] = player.balence - record['balence']
+        self.hands += 1
+        self.size += 1
+        if self.size == len(self.buffer):
+            self.flush()
+    def flush(self):
+        self.file.write(self.buffer[:self.size].tobytes())
+        self.buffer[:self.size] = 0
+        self.size = 0
+    def close(self):
+        self.flush()
+        self.file.close()
+
+def segments(hands):
+    """ the cards dealt from each shuffle of the shoe in a history """
+    shoes = [[]]
+    for record in hands:
+        if record['flags'] & TRUNCATED:
+            raise ValueError('truncated round can not be replayed',
+                    int(record['hand']))
+        cards = list(record['cards'][:record['ncards']])
+        at = record['shuffle_at']
+        if at != NONE:
+            shoes[-1].extend(cards[:at])
+            shoes.append([])
+            cards = cards[at:]
+        shoes[-1].extend(cards)
+    return shoes
+
+class ReplayShoe(Shoe):
+    """ Shoe dealing the recorded cards of a history
+
+    Each recorded shuffle is dealt in turn: a "shuffle" keeps the cards on
+    the table and loads the cards the shoe dealt after it was reshuffled,
+    and EndOfHistory is raised once they run out. len counts the cards
+    left as the recorded shoe would, including those that were never
+    dealt. decks, when given, must be the number the history was recorded
+    with.
+    """
+    def __init__(self, hands, decks=None):
+        recorded = history_decks(hands)
+        if decks is not None and decks != recorded:
+            raise ValueError('history was recorded with', recorded, 'decks')
+        self.decks = recorded
+        self.segments = iter([[Card('Spades', VALS[code])
+                for code in cards] for cards in segments(hands)])
+        self.cards = []
+        self.pos = 0
+        self.cut = 0
+        self.round_start = 0
+        self.shuffles = 0
+        self.shuffle()
+    def __len__(self):
+        return max(0, self.decks*52 - self.pos)
+    def shuffle(self):
+        in_play = self.cards[self.round_start:self.pos]
+        segment = next(self.segments, None)
+        if segment is None:
+            raise EndOfHistory()
+        self.cards = in_play + segment
+        self.pos = len(in_play)
+        self.round_start = 0
+        self.shuffles += 1
+        self.cut = len(self.cards)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Play blackjack at the terminal against the dealer
+
+    python interactive.py
+
+Kept apart from mc21 so batch runs never load the terminal code.
+"""
+import os, time
+from blackjack import Shoe, CardsShowing, Status, Dealer, UIPlayer
+from blackjack import deal_cards, clear_table
+
+def print_UI(dealer, player1, dealer_move=False):
+    os.system('cls' if os.name == 'nt' else 'clear')
+    print('Balence:', player1.balence)
+    print('Wager:', player1.wager, '\n')
+    print(len(player1.shoe))
+    for card in player1.shoe:
+        print(card, ',', end=' ')
+    print()
+    if dealer_move:
+        print('Dealer showing:', dealer.best_hand_val())
+        dealer.disp_hand()
+        print()
+    else:
+        print('Dealer showing:\n'+str(dealer.hand[0]), '\n')
+    print('Your hand:', player1.best_hand_val())
+    player1.disp_hand()
+
+def UImain():
+    shoe = Shoe(decks=1)
+    cards_showing = CardsShowing(shoe)
+
+    player1 = UIPlayer(200.0, shoe, cards_showing)
+    dealer = Dealer(shoe, cards_showing)
+    while player1.balence > 0:
+        os.system('cls' if os.name == 'nt' else 'clear')
+        print('Balence:', player1.balence)
+        s = int(input('Place wager amount: '))
+        player1.set_wager(s)
+        deal_cards([dealer, player1])
+
+        # UI player loop
+        while (player1.status != Status.STAND):
+            print_UI(dealer, player1)
+            player1.move()
+
+        while dealer.status != Status.STAND:
+            print_UI(dealer, player1, dealer_move=True)
+            dealer.move()
+            time.sleep(1)
+        print_UI(dealer, player1, dealer_move=True)
+
+        dealer_hand_val = dealer.best_hand_val()
+        p_hand_val = player1.best_hand_val()
+
+        if p_hand_val > 21 or p_hand_val <= 0:
+            print('You lose', player1.wager)
+            player1.lose()
+        elif player1.has_blackjack() and not dealer.has_blackjack():
+            print('You win', player1.wager)
+            player1.win()
+        elif not player1.has_blackjack() and dealer.has_blackjack():
+            print('You lose', player1.wager)
+            player1.lose()
+        elif p_hand_val > dealer_hand_val:
+            print('You win', player1.wager)
+            player1.win()
+        elif p_hand_val < dealer_hand_val:
+            print('You lose', player1.wager)
+            player1.lose()
+
+        input('\nhit any key to continue ')
+        clear_table([dealer, player1])
+
+if __name__ == '__main__':
+    UImain()
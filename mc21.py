@@ -1,166 +1,788 @@
 #!/usr/bin/env python3
-import random, os, time
-import matplotlib.pyplot as plt
+import argparse, json, random, os, time
 import numpy as np
 from multiprocessing import Pool
-from blackjack import Card, Status, Player, Dealer, UIPlayer, SimplePlayer
-from blackjack import BasicStratPlayer, CCPlayer, HLPlayer, deal_cards
-from blackjack import clear_table, print_UI
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+from blackjack import Shoe, CardsShowing, Status, Dealer
+from blackjack import SimplePlayer, BasicStratPlayer, TablePlayer, CCPlayer
+from blackjack import HLPlayer
+from blackjack import deal_cards, clear_table
+from vecsim import simulate_trials
+from stats import RunningStats, QuantileSketch, Profile, CountStats
+import history
+import plots
 
 TRIALS = 1000
 HANDS = 16000
-VALS = ['A', '2', '3', '4', '5', '6', '7', '8', '9', '10','J', 'Q', 'K']
-SUITS = ['Clubs', 'Heart', 'Diamond', 'Spades']
-
-def UImain():
-    used_cards = []
-    cards_showing = []
-    deck = []
-    for decks in range(1):
-        for val in VALS:
-            for suit in SUITS:
-                deck.append(Card(suit, val))
-    random.shuffle(deck)
-    blank_card = Card('Plastic', 'Blank')
-    rand_index = 8 + random.randint(-4,4)
-    deck.insert(rand_index, blank_card)
-
-    player1 = UIPlayer(200.0, deck, used_cards, cards_showing)
-    dealer = Dealer(deck, used_cards, cards_showing)
-    while player1.balence > 0:
-        os.system('cls' if os.name == 'nt' else 'clear')
-        print('Balence:', player1.balence)
-        s = int(input('Place wager amount: '))
-        player1.set_wager(s)
-        deal_cards([dealer, player1])
-
-        # UI player loop
-        while (player1.status != Status.STAND):
-            print_UI(dealer, player1)
-            player1.move()
-
-        while dealer.status != Status.STAND:
-            print_UI(dealer, player1, dealer_move=True)
-            dealer.move()
-            time.sleep(1)
-        print_UI(dealer, player1, dealer_move=True)
-
-        dealer_hand_val = dealer.best_hand_val()
-        p_hand_val = player1.best_hand_val()
-
-        if p_hand_val > 21 or p_hand_val <= 0:
-            print('You lose', player1.wager)
-            player1.lose()
-        elif player1.has_blackjack() and not dealer.has_blackjack():
-            print('You win', player1.wager)
-            player1.win()
-        elif not player1.has_blackjack() and dealer.has_blackjack():
-            print('You lose', player1.wager)
-            player1.lose()
-        elif p_hand_val > dealer_hand_val:
-            print('You win', player1.wager)
-            player1.win()
-        elif p_hand_val < dealer_hand_val:
-            print('You lose', player1.wager)
-            player1.lose()
-
-        input('\nhit any key to continue ')
-        clear_table([dealer, player1])
-
-def simulate_trial(num_hands):
-    """ returns balence_log array for player one during simulated number of hands """
-    balence_log = []
+DECKS = 8
+PLAYER = TablePlayer # BasicStratPlayer, SimplePlayer, HLPlayer
+VECTORIZED = False # play all trials in lockstep with vecsim
+STREAM = False # fold trials into running stats instead of keeping them all
+BLOCK = 10 # trials per task
+VECTOR_BLOCK = 100 # trials per task of the vectorized engine, wide runs fast
+SAMPLES = 20 # trials kept for plotting when streaming
+SKETCH = 200 # hands with a quantile sketch of the balence, none when 0
+SHARED_DTYPE = np.float64 # balences written by workers into shared memory
+SEED = None # master seed, fresh entropy when None
+PROFILE = False # time the phases of every round and count game events
+WORKERS = None # pool processes, os.cpu_count() when None
+HISTORY = None # directory to record every hand of every trial to
+COUNT_STATS = False # collect the expected return by true count
+
+# settings workers read, handed to them by worker_pool
+SETTINGS = ('TRIALS', 'HANDS', 'DECKS', 'PLAYER', 'VECTORIZED', 'STREAM',
+        'BLOCK', 'VECTOR_BLOCK', 'SAMPLES', 'SKETCH', 'SHARED_DTYPE',
+        'PROFILE', 'WORKERS', 'HISTORY', 'COUNT_STATS')
+
+PLAYERS = dict((cls.__name__, cls) for cls in
+        (SimplePlayer, BasicStratPlayer, TablePlayer, HLPlayer, CCPlayer))
+
+_results = None # worker view of the shared balence matrix
+_shared_blocks = [] # shared memory a worker keeps mapped until it exits
+_profile = None # Profile of the task running in this process
+_run_profile = Profile() # Profile merged from the tasks of the run
+_counts = None # CountStats of the task running in this process
+_run_counts = CountStats() # CountStats merged from the tasks of the run
+
+def settings():
+    """ the SETTINGS of this process by name """
+    return dict((name, globals()[name]) for name in SETTINGS)
+
+def configure(values, attach=None, *args):
+    """ pool initializer giving a worker the parent's settings, which a
+    worker that is spawned rather than forked would import as the
+    defaults, then calling attach(*args) to map shared results """
+    globals().update(values)
+    if attach is not None:
+        attach(*args)
+
+def worker_pool(attach=None, *args):
+    """ Pool of WORKERS processes set up with the settings of this one """
+    return Pool(WORKERS, initializer=configure,
+            initargs=(settings(), attach) + args)
+
+def trial_seed(seed, index):
+    """ seed of the independent stream of trial (or chunk) index spawned
+    from the master seed, the same as SeedSequence(seed).spawn()[index] """
+    state = np.random.SeedSequence(seed, spawn_key=(index,)).generate_state(4)
+    return int.from_bytes(state.tobytes(), 'little')
+
+def simulate_trial(num_hands, out=None, seed=None, record=None):
+    """ returns balence_log array for player one during simulated number of hands
+
+    the balences are written into out when it is given, seed seeds the
+    shoe's shuffles and cut card placement and every hand is recorded to
+    the history file record when it is given
+    """
+    balence_log = [0.0]*num_hands if out is None else out
     # init cards 
-    used_cards = []
-    cards_showing = []
-    deck = []
-    for _ in range(8):
-        for val in VALS:
-            for suit in SUITS:
-                deck.append(Card(suit, val))
-    random.shuffle(deck)
-    blank_card = Card('Plastic', 'Blank')
-    rand_index = 8 + random.randint(-4,4)
-    deck.insert(rand_index, blank_card)
-
-    dealer = Dealer(deck, used_cards, cards_showing)
-    # player1 = SimplePlayer(0, deck, used_cards, cards_showing)
-    player1 = BasicStratPlayer(0, deck, used_cards, cards_showing, dealer)
-    # player1 = HLPlayer(0, deck, used_cards, cards_showing, dealer)
+    shoe = Shoe(DECKS, rng=None if seed is None else random.Random(seed))
+    cards_showing = CardsShowing(shoe)
+
+    dealer = Dealer(shoe, cards_showing)
+    player1 = PLAYER(0, shoe, cards_showing, dealer)
 
     players = [player1]
+    profile = _profile
+    if profile is not None:
+        profile.instrument(player1)
+    recorders = []
+    if record is not None:
+        recorders.append(history.HandRecorder(record, shoe, cards_showing))
+    if _counts is not None:
+        recorders.append(_counts)
+    for recorder in recorders:
+        recorder.instrument(player1)
     for j in range(num_hands):
-        deal_cards([dealer] + players)
-        balence_log.append(player1.balence)
+        balence_log[j] = player1.balence
+        for recorder in recorders:
+            recorder.start(player1)
+        play_round(dealer, players, profile, recorders)
+        for recorder in recorders:
+            recorder.finish(player1)
+    if profile is not None:
+        profile.count('reshuffles', shoe.shuffles - 1)
+    if record is not None:
+        recorders[0].close()
+    return balence_log
 
-        # set wager
-        for player in players:
-            player.set_wager(1)
+def replay_trial(path, player_cls=None, decks=None):
+    """ returns the balence log and final balence of player_cls (PLAYER
+    when None) playing the shoes recorded in the history file path
+
+    the round the recorded cards run out in is not played, the shoe has as
+    many decks as the recorded one and decks, when given, must agree
+    """
+    shoe = history.ReplayShoe(history.read_history(path), decks)
+    cards_showing = CardsShowing(shoe)
+    dealer = Dealer(shoe, cards_showing)
+    player1 = (player_cls or PLAYER)(0, shoe, cards_showing, dealer)
+    balence_log = []
+    try:
+        while True:
+            balence = player1.balence
+            play_round(dealer, [player1])
+            balence_log.append(balence)
+    except history.EndOfHistory:
+        player1.balence = balence
+    return balence_log, player1.balence
+
+def play_replay(task):
+    path, player_cls, decks = task
+    hands = history.read_history(path)
+    balence_log, balence = replay_trial(path, player_cls, decks)
+    return len(hands), float(hands['outcome'].sum()), len(balence_log), balence
+
+def run_replay(paths, player_cls, decks=None):
+    """ prints the return per hand recorded in the history files and the
+    one player_cls makes on the same shoes, raises ValueError when decks is
+    given and a file was recorded with another number """
+    with worker_pool() as pool:
+        results = pool.map(play_replay, [(path, player_cls, decks)
+            for path in paths])
+    recorded = sum(result[1] for result in results)/max(1,
+            sum(result[0] for result in results))
+    replayed = sum(result[3] for result in results)/max(1,
+            sum(result[2] for result in results))
+    print('recorded: ', str(round(recorded*100, 4))+'%')
+    print(player_cls.__name__+':', str(round(replayed*100, 4))+'%')
 
-        # player loop
-        while sum([player.status for player in players]):
-            for player in players:
-                if player.status == Status.STAND:
-                    continue
-                player.move()
+def play_round(dealer, players, profile=None, recorders=()):
+    """ deals, plays and settles one round for the players at the table
 
-        # dealer loop
-        while dealer.status != Status.STAND:
-            dealer.move()
+    the time of each phase goes to profile (a stats.Profile) when given and
+    the played out hands to the played method of each of recorders (such
+    as a history.HandRecorder or a stats.CountStats)
+    """
+    if profile is not None:
+        profile.start()
+    deal_cards([dealer] + players)
+    if profile is not None:
+        profile.lap('deal')
+    # set wager
+    for player in players:
+        player.set_wager(1)
+    if profile is not None:
+        profile.lap('wager')
 
-        # eval hands
-        dealer_hand_val = dealer.best_hand_val()
+    # player loop
+    while sum([player.status for player in players]):
         for player in players:
-            # no split
-            if len(player.split_hand) == 0:
+            if player.status == Status.STAND:
+                continue
+            player.move()
+    if profile is not None:
+        profile.lap('player')
+
+    # dealer loop
+    while dealer.status != Status.STAND:
+        dealer.move()
+    if profile is not None:
+        profile.lap('dealer')
+    for recorder in recorders:
+        recorder.played(dealer, players)
+
+    # eval hands
+    dealer_hand_val = dealer.best_hand_val()
+    for player in players:
+        # no split
+        if len(player.split_hand) == 0:
+            p_hand_val = player.best_hand_val()
+            if p_hand_val > 21 or p_hand_val <= 0:
+                player.lose()
+            elif player.has_blackjack() and not dealer.has_blackjack():
+                player.win(1.5)
+            elif not player.has_blackjack() and dealer.has_blackjack():
+                player.lose()
+            elif p_hand_val > dealer_hand_val:
+                player.win()
+            elif p_hand_val < dealer_hand_val:
+                player.lose()
+        # split hands
+        else:
+            for i in range(2):
+                if i == 1:
+                    player.swap_hands()
+                    player.set_wager(player.split_wager)
                 p_hand_val = player.best_hand_val()
                 if p_hand_val > 21 or p_hand_val <= 0:
                     player.lose()
-                elif player.has_blackjack() and not dealer.has_blackjack():
-                    player.win(1.5)
-                elif not player.has_blackjack() and dealer.has_blackjack():
-                    player.lose()
                 elif p_hand_val > dealer_hand_val:
                     player.win()
                 elif p_hand_val < dealer_hand_val:
                     player.lose()
-            # split hands
+    if profile is not None:
+        profile.lap('settle')
+        profile.tally(dealer, players)
+        profile.start()
+
+    clear_table([dealer]+players)
+    if profile is not None:
+        profile.lap('clear')
+
+def compare_trial(num_hands, player_classes, seed=None):
+    """ returns the final balence of each player class after num_hands
+    played on common random numbers
+
+    every class plays each round from the same shoe state, so all of them
+    see the same card order and count; the shoe then carries on from where
+    the first class left it
+    """
+    shoe = Shoe(DECKS, rng=None if seed is None else random.Random(seed))
+    cards_showing = CardsShowing(shoe)
+    tables = []
+    for player_cls in player_classes:
+        dealer = Dealer(shoe, cards_showing)
+        tables.append((dealer, player_cls(0, shoe, cards_showing, dealer)))
+    for j in range(num_hands):
+        start = shoe.getstate(), cards_showing.getstate()
+        for k, (dealer, player) in enumerate(tables):
+            if k:
+                shoe.setstate(start[0])
+                cards_showing.setstate(start[1])
+            play_round(dealer, [player])
+            if not k:
+                end = shoe.getstate(), cards_showing.getstate()
+        shoe.setstate(end[0])
+        cards_showing.setstate(end[1])
+    return [player.balence for _, player in tables]
+
+def play_compare(trial):
+    seed, index, player_classes = trial
+    return compare_trial(HANDS, player_classes, seed=trial_seed(seed, index))
+
+def run_compare(seed, player_classes):
+    """ prints the expected return of each player class and its paired
+    difference to the first one over TRIALS common random number trials """
+    with worker_pool() as pool:
+        finals = np.array(pool.map(play_compare,
+                [(seed, i, player_classes) for i in range(TRIALS)]))
+    returns = finals/HANDS*100
+    for k, player_cls in enumerate(player_classes):
+        ev = returns[:, k]
+        print(player_cls.__name__, 'exp return:', str(round(ev.mean(), 4))
+                +' +/-'+str(round(1.96*ev.std(ddof=1)/np.sqrt(TRIALS), 4))
+                +'%')
+        if k:
+            diff = ev - returns[:, 0]
+            print('  vs', player_classes[0].__name__+':',
+                    str(round(diff.mean(), 4))+' +/-'
+                    +str(round(1.96*diff.std(ddof=1)/np.sqrt(TRIALS), 4))
+                    +'% paired')
+    return finals
+
+def profiled(task):
+    """ runs task, a (function, argument) pair, with a fresh Profile when
+    PROFILE and fresh CountStats when COUNT_STATS and returns (result,
+    profile, count stats) """
+    global _profile, _counts
+    func, arg = task
+    _profile = Profile() if PROFILE else None
+    _counts = CountStats() if COUNT_STATS else None
+    try:
+        return func(arg), _profile, _counts
+    finally:
+        _profile = _counts = None
+
+def tasks(func, items):
+    """ func and items for a pool map, wrapped by profiled when PROFILE or
+    COUNT_STATS """
+    if not (PROFILE or COUNT_STATS):
+        return func, items
+    return profiled, [(func, item) for item in items]
+
+def collect(results):
+    """ yields the results of a map over tasks(), merging their profiles
+    into _run_profile and count stats into _run_counts """
+    for result in results:
+        if PROFILE or COUNT_STATS:
+            result, profile, counts = result
+            if profile is not None:
+                _run_profile.merge(profile)
+            if counts is not None:
+                _run_counts.merge(counts)
+        yield result
+
+def simulate_chunk(num_trials, out=None, seed=None):
+    """ returns balence logs of num_trials played by the vectorized engine """
+    return simulate_trials(num_trials, HANDS, PLAYER, DECKS, seed=seed,
+            out=out)
+
+def history_path(index):
+    return None if HISTORY is None else history.trial_path(HISTORY, index)
+
+def play_trial(trial):
+    seed, index = trial
+    return simulate_trial(HANDS, seed=trial_seed(seed, index),
+            record=history_path(index))
+
+def play_chunk(block):
+    seed, index, num_trials = block
+    return simulate_chunk(num_trials, seed=trial_seed(seed,
+        index*block_size()))
+
+def attach_results(name, shape):
+    """ maps the parent's shared balence matrix in a worker """
+    global _results
+    block = shared_memory.SharedMemory(name=name)
+    _shared_blocks.append(block)
+    _results = np.ndarray(shape, dtype=SHARED_DTYPE, buffer=block.buf)
+
+def fill_trial(trial):
+    seed, index = trial
+    simulate_trial(HANDS, out=_results[index], seed=trial_seed(seed, index),
+            record=history_path(index))
+
+def fill_chunk(block):
+    seed, index, num_trials = block
+    start = index*block_size()
+    simulate_chunk(num_trials, out=_results[start:start + num_trials],
+            seed=trial_seed(seed, start))
+
+def run_shared(seed):
+    """ returns the stats of the (TRIALS, HANDS) balence matrix the workers
+    wrote straight into shared memory, None when shared memory is not
+    available
+
+    the block is unmapped once the stats are taken, so repeated runs in one
+    process do not keep their matrices
+    """
+    shape = (TRIALS, HANDS)
+    try:
+        block = shared_memory.SharedMemory(create=True,
+                size=TRIALS*HANDS*np.dtype(SHARED_DTYPE).itemsize)
+    except (AttributeError, OSError):
+        return None
+    try:
+        with worker_pool(attach_results, block.name, shape) as pool:
+            if VECTORIZED:
+                list(collect(pool.map(*tasks(fill_chunk, blocks(seed)))))
             else:
-                for i in range(2):
-                    if i == 1:
-                        player.hand = player.split_hand
-                        player.set_wager(player.split_wager)
-                    p_hand_val = player.best_hand_val()
-                    if p_hand_val > 21 or p_hand_val <= 0:
-                        player.lose()
-                    elif p_hand_val > dealer_hand_val:
-                        player.win()
-                    elif p_hand_val < dealer_hand_val:
-                        player.lose()
-
-        clear_table([dealer]+players)
-    return balence_log
+                list(collect(pool.map(*tasks(fill_trial,
+                    [(seed, i) for i in range(TRIALS)]))))
+        return memmap_stats(np.ndarray(shape, dtype=SHARED_DTYPE,
+            buffer=block.buf))
+    finally:
+        block.close()
+        block.unlink()
+
+def hand_stats(hands=None, samples=SAMPLES):
+    """ empty RunningStats of the balence per hand with extrema, samples
+    and a quantile sketch of SKETCH hands spread evenly over the trial """
+    hands = HANDS if hands is None else hands
+    sketch = None
+    if SKETCH:
+        indexes = np.unique(np.linspace(0, hands - 1, SKETCH, dtype=int))
+        # the spread of a random walk grows with the square root of its steps
+        sketch = QuantileSketch(indexes, np.sqrt(indexes + 1.0))
+    return RunningStats(hands, extrema=True, samples=samples, sketch=sketch)
+
+def simulate_block(block):
+    """ returns RunningStats of the balence per hand over a block of trials
+
+    block is (seed, index, number of trials); only the first blocks keep
+    sample trials so workers do not ship more than SAMPLES of them in total
+    """
+    seed, index, num_trials = block
+    start = index*block_size()
+    stats = hand_stats(samples=max(0, min(num_trials, SAMPLES - start)))
+    if VECTORIZED:
+        stats.add_batch(simulate_chunk(num_trials,
+                seed=trial_seed(seed, start)))
+    else:
+        for i in range(start, start + num_trials):
+            stats.add(simulate_trial(HANDS, seed=trial_seed(seed, i),
+                record=history_path(i)))
+    return stats
+
+def block_size():
+    """ trials per block, the vectorized engine seeds each block as one """
+    return VECTOR_BLOCK if VECTORIZED else BLOCK
+
+def blocks(seed, first=0, last=None):
+    """ (seed, index, number of trials) of blocks first up to last
+
+    blocks are the same whatever the number of workers, so a seeded run
+    gives the same numbers on any host
+    """
+    size = block_size()
+    last = -(-TRIALS//size) if last is None else last
+    return [(seed, i, min(size, TRIALS - i*size)) for i in range(first, last)]
+
+def run_blocks(todo):
+    """ plays the blocks through the pool, yields their stats in order """
+    with worker_pool() as pool:
+        for part in collect(pool.imap(*tasks(simulate_block, todo))):
+            yield part
+
+def merge_blocks(parts):
+    """ merges block stats in block order, so any split of the blocks
+    merged this way gives exactly the same numbers """
+    stats = hand_stats()
+    for part in parts:
+        stats.merge(part)
+    return stats
+
+def run_stats(seed):
+    """ streams TRIALS trials through the pool, O(HANDS) memory """
+    return merge_blocks(run_blocks(blocks(seed)))
+
+def run_shard(seed, shard, num_shards, path):
+    """ plays shard of num_shards equal runs of blocks, saves their stats """
+    bounds = np.linspace(0, -(-TRIALS//block_size()), num_shards + 1,
+            dtype=int)
+    todo = blocks(seed, bounds[shard], bounds[shard + 1])
+    parts = list(run_blocks(todo))
+    extrema = merge_blocks(parts)
+    sketch = {}
+    if extrema.sketch is not None:
+        sketch = dict(sketch_hands=extrema.sketch.indexes,
+                sketch_counts=extrema.sketch.counts)
+    np.savez(path, seed=str(seed), trials=TRIALS, hands=HANDS, decks=DECKS,
+            block=block_size(), player=PLAYER.__name__, vectorized=VECTORIZED,
+            blocks=[index for _, index, _ in todo],
+            count=[part.count[0] for part in parts],
+            mean=np.array([part.mean for part in parts]).reshape(-1, HANDS),
+            m2=np.array([part.m2 for part in parts]).reshape(-1, HANDS),
+            min=extrema.min, max=extrema.max,
+            samples=np.array(extrema.samples).reshape(-1, HANDS), **sketch)
+
+def merge_shards(paths):
+    """ returns (seed, RunningStats) of the shard files of one run """
+    shards = [np.load(path) for path in paths]
+    keys = ('seed', 'trials', 'hands', 'decks', 'block', 'player',
+            'vectorized')
+    for shard, path in zip(shards, paths):
+        if any(shard[key] != shards[0][key] for key in keys):
+            raise ValueError('shard is from a different run', path)
+    order = sorted((index, i, j) for i, shard in enumerate(shards)
+            for j, index in enumerate(shard['blocks']))
+    num_blocks = -(-int(shards[0]['trials'])//int(shards[0]['block']))
+    if [index for index, _, _ in order] != list(range(num_blocks)):
+        raise ValueError('shards do not cover every block exactly once')
+    hands = int(shards[0]['hands'])
+    parts = []
+    for _, i, j in order:
+        part = RunningStats(hands)
+        part.count[...] = shards[i]['count'][j]
+        part.mean = shards[i]['mean'][j]
+        part.m2 = shards[i]['m2'][j]
+        parts.append(part)
+    stats = hand_stats(hands)
+    for part in parts:
+        stats.merge(part)
+    if stats.sketch is not None and not all('sketch_counts' in shard and
+            np.array_equal(shard['sketch_hands'], stats.sketch.indexes)
+            for shard in shards):
+        stats.sketch = None # not every shard sketched the same hands
+    for shard in shards:
+        np.minimum(stats.min, shard['min'], out=stats.min)
+        np.maximum(stats.max, shard['max'], out=stats.max)
+        if stats.sketch is not None:
+            stats.sketch.counts += shard['sketch_counts']
+        stats.samples.extend(list(shard['samples'])[:SAMPLES -
+                len(stats.samples)])
+    return int(str(shards[0]['seed'])), stats
+
+def open_run(run_dir, seed):
+    """ returns the master seed of the checkpointed run in run_dir
+
+    creates the run (manifest.json, balences.npy memmap) when run_dir does
+    not hold one yet and checks the settings match when it does
+    """
+    manifest = dict(trials=TRIALS, hands=HANDS, decks=DECKS,
+            block=block_size(), player=PLAYER.__name__, vectorized=VECTORIZED)
+    path = os.path.join(run_dir, 'manifest.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+        saved_seed = saved.pop('seed')
+        if saved != manifest:
+            raise ValueError('run directory holds a different run', run_dir,
+                    saved)
+        if seed is not None and seed != saved_seed:
+            raise ValueError('run directory was seeded with', saved_seed)
+        return saved_seed
+    os.makedirs(run_dir, exist_ok=True)
+    np.lib.format.open_memmap(os.path.join(run_dir, 'balences.npy'),
+            mode='w+', dtype=SHARED_DTYPE, shape=(TRIALS, HANDS)).flush()
+    manifest['seed'] = np.random.SeedSequence(seed).entropy
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest['seed']
+
+def attach_run(path):
+    """ maps the run's balences.npy in a worker """
+    global _results
+    _results = np.load(path, mmap_mode='r+')
+
+def store_block(block):
+    """ plays a block of trials straight into the run's memmap """
+    seed, index, num_trials = block
+    start = index*block_size()
+    if VECTORIZED:
+        simulate_chunk(num_trials, out=_results[start:start + num_trials],
+                seed=trial_seed(seed, start))
+    else:
+        for i in range(start, start + num_trials):
+            simulate_trial(HANDS, out=_results[i], seed=trial_seed(seed, i),
+                    record=history_path(i))
+    _results.flush()
+    return block
+
+def run_checkpointed(seed, run_dir):
+    """ plays the trials of run_dir that are not completed yet and returns
+    its balence matrix as a read only memmap
+
+    completed.txt lists the trial IDs and seeds of every block written to
+    balences.npy, so an interrupted run picks up where it stopped
+    """
+    log_path = os.path.join(run_dir, 'completed.txt')
+    completed = set()
+    if os.path.exists(log_path):
+        with open(log_path) as f:
+            completed = set(int(line.split()[0]) for line in f if line.strip())
+    size = block_size()
+    todo = [block for block in blocks(seed)
+            if not all(i in completed for i in
+                range(block[1]*size, block[1]*size + block[2]))]
+    npy_path = os.path.join(run_dir, 'balences.npy')
+    if todo:
+        print('resuming:', TRIALS - len(completed), 'trials to go')
+        with worker_pool(attach_run, npy_path) as pool, \
+                open(log_path, 'a') as log:
+            for _, index, num_trials in collect(pool.imap_unordered(
+                    *tasks(store_block, todo))):
+                start = index*size
+                for i in range(start, start + num_trials):
+                    log.write('%d %d\n' % (i,
+                        trial_seed(seed, start if VECTORIZED else i)))
+                log.flush()
+                os.fsync(log.fileno())
+    return np.load(npy_path, mmap_mode='r')
+
+def memmap_stats(balences, rows=256):
+    """ RunningStats of a balence matrix (or memmap) read a few rows at a
+    time """
+    stats = hand_stats(balences.shape[1])
+    for start in range(0, len(balences), rows):
+        stats.add_batch(balences[start:start + rows])
+    return stats
+
+def run_adaptive(seed, precision, max_seconds=None, max_hands=None):
+    """ plays batches of blocks until the 95% confidence interval of the
+    expected return per hand is within +/-precision percent, or until
+    max_seconds or max_hands is used up
+
+    the confidence interval is the one of the mean return, not the spread
+    of single trials that main plots. Returns (stats, hands played, reason).
+    Blocks are merged in order and the precision and hand budget are
+    checked after each one, so a seeded run stops after the same trials and
+    gives the same numbers every time, whatever the number of workers.
+    """
+    start = time.time()
+    batch = WORKERS or os.cpu_count() or 1
+    stats = hand_stats()
+    with worker_pool() as pool:
+        first = 0
+        while True:
+            todo = [(seed, i, block_size())
+                    for i in range(first, first + batch)]
+            for part in collect(pool.map(*tasks(simulate_block, todo))):
+                stats.merge(part)
+                hands = int(stats.count[-1])*HANDS
+                if mean_ci95(stats)/HANDS*100 <= precision:
+                    return stats, hands, 'precision'
+                if max_hands is not None and hands >= max_hands:
+                    return stats, hands, 'hand budget'
+            first += batch
+            if max_seconds is not None and time.time() - start >= max_seconds:
+                return stats, hands, 'time budget'
+
+def mean_ci95(stats):
+    """ half width of the 95% confidence interval of the mean final
+    balence, inf until there are two trials """
+    n = int(stats.count[-1])
+    if n < 2:
+        return np.inf
+    return 1.96*np.sqrt(stats.m2[-1]/(n - 1)/n)
+
+def report(avg, ci95, hands):
+    print('exp return:', str(round((avg[-1]/hands*100), 4))+' +/-'
+            +str(round((ci95[-1]/hands*100), 4))+'%')
+
+def save_stats(path, seed, stats):
+    """ saves the settings and per hand statistics of a run as .npz """
+    extra = {}
+    if COUNT_STATS:
+        extra = dict(true_counts=_run_counts.counts,
+                count_hands=_run_counts.hands, count_mean=_run_counts.mean,
+                count_m2=_run_counts.m2, **dict(('count_' + event, n)
+                    for event, n in _run_counts.events.items()))
+    if stats.sketch is not None:
+        extra.update(sketch_hands=stats.sketch.indexes,
+                sketch_counts=stats.sketch.counts)
+    np.savez(path, seed=str(seed), trials=TRIALS, hands=HANDS, decks=DECKS,
+            player=PLAYER.__name__, vectorized=VECTORIZED, count=stats.count,
+            mean=stats.mean, m2=stats.m2, min=stats.min, max=stats.max,
+            **extra)
+
+def main(seed=SEED, run_dir=None, plot=None, out=None, counts_plot=None):
+    """ runs TRIALS trials, reports the expected return, saves the
+    statistics to the file out and plots the balences to the file plot
+    (shown when None, skipped when False) and the expected return by true
+    count to counts_plot """
+    if run_dir is None:
+        seed = np.random.SeedSequence(seed).entropy
+    else:
+        seed = open_run(run_dir, seed)
+    print('seed:', seed)
+    if run_dir is not None:
+        stats = memmap_stats(run_checkpointed(seed, run_dir))
+    elif STREAM:
+        stats = run_stats(seed)
+    else:
+        stats = run_shared(seed)
+        if stats is None:
+            with worker_pool() as pool:
+                if VECTORIZED:
+                    winnings = np.vstack(list(collect(
+                        pool.map(*tasks(play_chunk, blocks(seed))))))
+                else:
+                    winnings = list(collect(pool.map(*tasks(play_trial,
+                        [(seed, i) for i in range(TRIALS)]))))
+            stats = memmap_stats(np.array(winnings))
+
+    report(stats.mean, stats.std()*1.96, HANDS) # 95% confidence interval
+    if PROFILE:
+        print(_run_profile.table())
+    if COUNT_STATS:
+        print(_run_counts.table())
+        if counts_plot is not None:
+            plots.plot_counts(_run_counts, counts_plot)
+    if out is not None:
+        save_stats(out, seed, stats)
+    if plot is not False:
+        plots.plot_trials(stats, TRIALS, plot)
+
+def cli():
+    global PROFILE, COUNT_STATS, TRIALS, HANDS, DECKS, WORKERS, PLAYER
+    global HISTORY
+    parser = argparse.ArgumentParser(description='Blackjack Monte Carlo runner')
+    table = argparse.ArgumentParser(add_help=False)
+    table.add_argument('--trials', type=int, help='default %d' % TRIALS)
+    table.add_argument('--hands', type=int,
+            help='hands per trial, default %d' % HANDS)
+    table.add_argument('--decks', type=int, help='default %d' % DECKS)
+    table.add_argument('--workers', type=int,
+            help='pool processes, default one per cpu')
+    player = argparse.ArgumentParser(add_help=False)
+    player.add_argument('--player', choices=sorted(PLAYERS),
+            help='strategy to play, default ' + PLAYER.__name__)
+    commands = parser.add_subparsers(dest='command')
+    run = commands.add_parser('run', parents=[table, player],
+            help='simulate and plot (default)')
+    run.add_argument('--seed', type=int, default=SEED)
+    run.add_argument('--run-dir', help='checkpoint trials to this '
+            'directory and resume the run it holds')
+    run.add_argument('--plot', help='save the plot to this .png/.svg file '
+            'instead of showing it')
+    run.add_argument('--no-plot', action='store_true',
+            help='report only, for batch jobs')
+    run.add_argument('--out', help='save the per hand statistics as .npz')
+    run.add_argument('--history', help='record every hand to a file per '
+            'trial in this directory')
+    run.add_argument('--counts', action='store_true',
+            help='tabulate the expected return by true count')
+    run.add_argument('--counts-plot', help='plot the expected return by '
+            'true count to this file, implies --counts')
+    run.add_argument('--profile', action='store_true',
+            help='time the phases of each round and count game events')
+    shard = commands.add_parser('shard', parents=[table, player],
+            help='play one shard of a seeded streamed run')
+    shard.add_argument('--seed', type=int, required=True)
+    shard.add_argument('--shard', required=True, metavar='K/N',
+            help='play shard K (from 0) of N')
+    shard.add_argument('--out', required=True, help='.npz results file')
+    merge = commands.add_parser('merge',
+            help='combine shard files into the statistics of the full run')
+    merge.add_argument('paths', nargs='+')
+    merge.add_argument('--plot', help='save the plot to this file')
+    replay = commands.add_parser('replay', parents=[table, player],
+            help='play a strategy on the shoes of recorded hand histories')
+    replay.add_argument('paths', nargs='+')
+    compare = commands.add_parser('compare', parents=[table],
+            help='play strategies on the same shoes, paired differences')
+    compare.add_argument('--seed', type=int, default=SEED)
+    compare.add_argument('players', nargs='+', metavar='PLAYER',
+            choices=sorted(PLAYERS), help='player classes, the first one '
+            'is the baseline')
+    adaptive = commands.add_parser('adaptive', parents=[table, player],
+            help='play until the expected return is known to a precision')
+    adaptive.add_argument('--seed', type=int, default=SEED)
+    adaptive.add_argument('--precision', type=float, default=0.1,
+            help='target 95%% confidence half width in percent per hand')
+    adaptive.add_argument('--max-seconds', type=float,
+            help='wall clock budget')
+    adaptive.add_argument('--max-hands', type=int, help='hand budget')
+    adaptive.add_argument('--profile', action='store_true',
+            help='time the phases of each round and count game events')
+    adaptive.add_argument('--counts', action='store_true',
+            help='tabulate the expected return by true count')
+    args = parser.parse_args()
 
-def main():
-    with Pool() as pool:
-        winnings = pool.map(simulate_trial, [HANDS]*TRIALS)
-    winnings = np.array(winnings)
-
-    # plot all simulated games
-    t = np.arange(0, HANDS)
-    for i in range(TRIALS):
-        plt.plot(t, winnings[:][i])
-    plt.title(str(TRIALS)+' simulated games')
-    plt.xlabel('Number of hands played')
-    plt.ylabel('Balence')
-    t = np.arange(0, HANDS)
-    avg = np.mean(winnings, axis=0)
-    ci95 = np.std(winnings, axis=0)*1.96 # 95% confidence interval
-    plt.plot(t, avg, 'k', t, avg-ci95, 'k--', t, avg+ci95, 'k--')
-    plt.xlabel('Number of hands played')
-    print('exp return:', str(round((avg[-1]/HANDS*100), 4))+' +/-'
-            +str(round((ci95[-1]/HANDS*100), 4))+'%')
-    plt.show()
+    PROFILE = PROFILE or getattr(args, 'profile', False)
+    COUNT_STATS = (COUNT_STATS or getattr(args, 'counts', False) or
+            getattr(args, 'counts_plot', None) is not None)
+    if COUNT_STATS and VECTORIZED:
+        parser.error('the vectorized engine does not collect count stats')
+    TRIALS = getattr(args, 'trials', None) or TRIALS
+    HANDS = getattr(args, 'hands', None) or HANDS
+    DECKS = getattr(args, 'decks', None) or DECKS
+    WORKERS = getattr(args, 'workers', None) or WORKERS
+    if getattr(args, 'player', None):
+        PLAYER = PLAYERS[args.player]
+    if getattr(args, 'history', None):
+        if VECTORIZED:
+            parser.error('the vectorized engine does not record hands')
+        HISTORY = args.history
+        os.makedirs(HISTORY, exist_ok=True)
+    if args.command == 'shard':
+        k, n = (int(x) for x in args.shard.split('/'))
+        run_shard(args.seed, k, n, args.out)
+    elif args.command == 'merge':
+        seed, stats = merge_shards(args.paths)
+        print('seed:', seed)
+        report(stats.mean, stats.std()*1.96, len(stats.mean))
+        if args.plot:
+            plots.plot_trials(stats, int(stats.count[-1]), args.plot)
+    elif args.command == 'replay':
+        run_replay(args.paths, PLAYER, args.decks)
+    elif args.command == 'compare':
+        seed = np.random.SeedSequence(args.seed).entropy
+        print('seed:', seed)
+        run_compare(seed, [PLAYERS[name] for name in args.players])
+    elif args.command == 'adaptive':
+        seed = np.random.SeedSequence(args.seed).entropy
+        print('seed:', seed)
+        stats, hands, reason = run_adaptive(seed, args.precision,
+                args.max_seconds, args.max_hands)
+        report(stats.mean, np.full(HANDS, mean_ci95(stats)), HANDS)
+        print('stopped on', reason, 'after', hands, 'hands in',
+                int(stats.count[-1]), 'trials')
+        if PROFILE:
+            print(_run_profile.table())
+        if COUNT_STATS:
+            print(_run_counts.table())
+    else:
+        plot = False if getattr(args, 'no_plot', False) else \
+                getattr(args, 'plot', None)
+        main(getattr(args, 'seed', SEED), getattr(args, 'run_dir', None),
+                plot, getattr(args, 'out', None),
+                getattr(args, 'counts_plot', None))
 
 if __name__ == '__main__':
-    main()
+    cli()
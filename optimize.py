@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Strategy table search by racing single cell changes
+
+    python optimize.py --seed 42 --steps 5 --out table.json
+
+Starting from the compiled basic strategy (or a saved table) every step
+builds one candidate per changed cell (hand class x total x upcard x
+action) and races them: each round all surviving candidates and the
+current table play the same seeded trials with the vectorized engine
+across the pool, and candidates whose paired difference to the leader is
+clearly negative are dropped. The winner replaces the current table when
+it beats it by a clear margin on fresh trials, which the selection has
+not seen, and the search stops when no change does.
+"""
+import argparse, json
+import numpy as np
+from multiprocessing import Pool
+from blackjack import Action, HandClass, BasicStratPlayer, compile_table
+from vecsim import simulate_trials
+import mc21
+
+TRIALS = 2048 # trials per candidate and round, wide rows run fastest
+HANDS = 50 # hands per trial
+ROUNDS = 8 # race rounds per step at most
+CONFIRM_ROUNDS = 4 # rounds of fresh trials the winner must clearly win
+Z = 2.58 # confidence of the racing tests (99%, two sided)
+EVAL_TRIALS = 2048 # trials of the final estimate
+EVAL_BLOCK = 256 # trials per seeded task of the final estimate
+
+# totals whose cells can change the play, per hand class
+TOTALS = {
+    HandClass.HARD: range(4, 21),
+    HandClass.SOFT: range(2, 21),
+    HandClass.ACES: range(2, 21),
+    HandClass.PAIR: range(2, 12),
+}
+UPCARDS = range(2, 12)
+
+def candidates(table, classes=tuple(HandClass)):
+    """ (hand class, total, upcard, action) of every one cell change """
+    for hand_class in classes:
+        actions = [Action.STAND, Action.HIT, Action.DOUBLE]
+        if hand_class == HandClass.PAIR:
+            actions.append(Action.SPLIT)
+        for total in TOTALS[hand_class]:
+            for up in UPCARDS:
+                for action in actions:
+                    if action != table[hand_class][total][up]:
+                        yield hand_class, total, up, action
+
+def changed(table, cell):
+    """ table with one cell set to a new action """
+    hand_class, total, up, action = cell
+    rows = list(table[hand_class])
+    row = list(rows[total])
+    row[up] = action
+    rows[total] = tuple(row)
+    return table[:hand_class] + (tuple(rows),) + table[hand_class + 1:]
+
+def describe(cell):
+    hand_class, total, up, action = cell
+    return '%s %d vs %d: %s' % (HandClass(hand_class).name, total, up,
+            Action(action).name)
+
+def round_seed(seed, step, index):
+    state = np.random.SeedSequence(seed, spawn_key=(step, index))
+    return int.from_bytes(state.generate_state(4).tobytes(), 'little')
+
+def play_table(task):
+    """ final balences of trials played with a table, task is (table,
+    seed, trials, hands, decks) """
+    table, seed, trials, hands, decks = task
+    return simulate_trials(trials, hands + 1, decks=decks, seed=seed,
+            table=table)[:, -1]
+
+def race(pool, table, cells, seed, step, trials=TRIALS, hands=HANDS,
+        rounds=ROUNDS, decks=mc21.DECKS):
+    """ returns the cell that beats table clearly, None when none does
+
+    entry 0 of the race is table itself, every cell is one candidate; all
+    of them play the same seeds each round, so their differences are paired.
+    The best of many candidates looks better on the trials that picked it
+    than it is, so it is only taken once confirm finds it clearly better
+    on fresh seeds too.
+    """
+    tables = [table] + [changed(table, cell) for cell in cells]
+    finals = [[] for _ in tables]
+    alive = list(range(len(tables)))
+    for index in range(rounds):
+        seed_r = round_seed(seed, step, index)
+        # table keeps playing once it is out, the winner is tested against it
+        playing = alive if alive[0] == 0 else [0] + alive
+        results = pool.map(play_table, [(tables[i], seed_r, trials, hands,
+            decks) for i in playing])
+        for i, result in zip(playing, results):
+            finals[i].append(result)
+        returns = dict((i, np.concatenate(finals[i])/hands) for i in playing)
+        # a cell the trials never reached plays exactly like the table
+        alive = [i for i in alive
+                if i == 0 or not np.array_equal(returns[i], returns[0])]
+        if not alive:
+            break
+        leader = max(alive, key=lambda i: returns[i].mean())
+        survivors = []
+        for i in alive:
+            diff = returns[i] - returns[leader]
+            half = Z*diff.std(ddof=1)/np.sqrt(len(diff))
+            if i == leader or diff.mean() + half >= 0:
+                survivors.append(i)
+        alive = survivors
+        print('step %d round %d: %d candidates left' % (step, index,
+            len(alive)))
+        if len(alive) == 1:
+            break
+    if not alive:
+        return None
+    best = max(alive, key=lambda i: returns[i].mean())
+    if best == 0:
+        return None
+    if not clearly_better(returns[best] - returns[0]):
+        return None
+    if not confirm(pool, table, tables[best], seed, step, rounds, trials,
+            hands, decks):
+        return None
+    return cells[best - 1]
+
+def clearly_better(diff):
+    """ whether the lower confidence bound of the paired differences in
+    return is above 0 """
+    return diff.mean() - Z*diff.std(ddof=1)/np.sqrt(len(diff)) > 0
+
+def confirm(pool, table, winner, seed, step, first, trials=TRIALS,
+        hands=HANDS, decks=mc21.DECKS):
+    """ whether winner beats table clearly on CONFIRM_ROUNDS rounds of
+    trials seeded as race rounds first on, which the race does not play """
+    seeds = [round_seed(seed, step, first + k) for k in range(CONFIRM_ROUNDS)]
+    results = pool.map(play_table, [(candidate, seed_r, trials, hands, decks)
+        for seed_r in seeds for candidate in (table, winner)])
+    diff = np.concatenate([new - old for old, new in
+        zip(results[::2], results[1::2])])/hands
+    better = clearly_better(diff)
+    print('step %d confirm: %+.4f%% per hand, %s' % (step,
+        diff.mean()*100, 'kept' if better else 'dropped'))
+    return better
+
+def evaluate(pool, table, seed, trials=EVAL_TRIALS, hands=mc21.HANDS,
+        decks=mc21.DECKS):
+    """ (expected return per hand, 95% confidence half width) of table over
+    independent seeded blocks of EVAL_BLOCK trials, the same on any number
+    of workers """
+    results = pool.map(play_table, [(table, mc21.trial_seed(seed, start),
+        min(EVAL_BLOCK, trials - start), hands, decks)
+        for start in range(0, trials, EVAL_BLOCK)])
+    returns = np.concatenate(results)/hands
+    return returns.mean(), 1.96*returns.std(ddof=1)/np.sqrt(len(returns))
+
+def optimize(seed, table=None, steps=10, classes=tuple(HandClass)):
+    """ returns the best table found and the changes made to reach it """
+    table = compile_table(BasicStratPlayer) if table is None else table
+    changes = []
+    with Pool() as pool:
+        for step in range(steps):
+            cell = race(pool, table, list(candidates(table, classes)), seed,
+                    step)
+            if cell is None:
+                break
+            print('step %d: %s' % (step, describe(cell)))
+            table = changed(table, cell)
+            changes.append(cell)
+    return table, changes
+
+def save_table(table, path, **info):
+    with open(path, 'w') as f:
+        json.dump(dict(info, table=[[[int(action) for action in row]
+            for row in rows] for rows in table]), f)
+
+def load_table(path):
+    """ table saved by save_table, ready for TablePlayer """
+    with open(path) as f:
+        table = json.load(f)['table']
+    return tuple(tuple(tuple(Action(action) for action in row)
+        for row in rows) for rows in table)
+
+def main():
+    parser = argparse.ArgumentParser(description='strategy table search')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--steps', type=int, default=10,
+            help='cell changes to make at most')
+    parser.add_argument('--classes', default='hard,soft,pair',
+            help='hand classes to search, from hard,soft,aces,pair')
+    parser.add_argument('--table', help='start from a saved table')
+    parser.add_argument('--eval-trials', type=int, default=EVAL_TRIALS,
+            help='trials of mc21.HANDS hands for the final estimate')
+    parser.add_argument('--out', help='save the best table as JSON')
+    args = parser.parse_args()
+
+    seed = np.random.SeedSequence(args.seed).entropy
+    print('seed:', seed)
+    classes = tuple(HandClass[name.upper()]
+            for name in args.classes.split(','))
+    start = None if args.table is None else load_table(args.table)
+    table, changes = optimize(seed, start, args.steps, classes)
+    with Pool() as pool:
+        # seeded like a step past the last, which no race played
+        ev, ci95 = evaluate(pool, table, round_seed(seed, args.steps, 0),
+                args.eval_trials)
+    print('changes:', ', '.join(describe(cell) for cell in changes) or
+            'none')
+    print('exp return:', str(round(ev*100, 4))+' +/-'
+            +str(round(ci95*100, 4))+'%')
+    if args.out:
+        save_table(table, args.out, seed=seed, changes=[describe(cell)
+            for cell in changes], exp_return=ev, ci95=ci95)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Plots of simulated trials that stay cheap however many trials and hands
+
+Individual paths are decimated to a few thousand points keeping the min and
+max of every bucket, only a sample of them is drawn, and the spread over all
+trials comes from the aggregated RunningStats and its quantile sketch.
+matplotlib is imported when a plot is made. A plot saved to a file is
+drawn on its own Agg canvas, so pyplot's backend is left alone for the
+plots that are shown.
+"""
+import numpy as np
+
+POINTS = 2000 # points kept per plotted series
+PATHS = 20 # sample trials drawn as lines
+
+def decimate(y, points=POINTS):
+    """ returns (x, y) of y cut down to about points values
+
+    y is split into points/2 buckets and the min and max of each bucket are
+    kept in the order they occur, so spikes survive the downsampling
+    """
+    y = np.asarray(y)
+    n = len(y)
+    if n <= points:
+        return np.arange(n), y
+    buckets = max(1, points//2)
+    size = -(-n//buckets)
+    padded = np.concatenate([y, np.repeat(y[-1:], buckets*size - n)])
+    padded = padded.reshape(buckets, size)
+    base = np.arange(buckets)*size
+    idx = np.concatenate([base + padded.argmin(axis=1),
+        base + padded.argmax(axis=1)])
+    idx = np.unique(np.minimum(idx, n - 1))
+    return idx, y[idx]
+
+def envelope(low, high, points=POINTS):
+    """ returns (x, low, high) with each bucket's lowest low and highest high """
+    n = len(low)
+    x = np.unique(np.linspace(0, n, min(n, points) + 1, dtype=int)[:-1])
+    return x, np.minimum.reduceat(low, x), np.maximum.reduceat(high, x)
+
+def figure(path):
+    """ (fig, ax) to draw a plot on: a pyplot figure when path is None,
+    otherwise a figure with an Agg canvas of its own """
+    if path is None:
+        import matplotlib.pyplot as plt
+        return plt.subplots()
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot(111)
+
+def show(fig, path):
+    """ saves fig to path, or shows it when path is None """
+    if path is None:
+        import matplotlib.pyplot as plt
+        plt.show()
+    else:
+        fig.savefig(path)
+
+def plot_trials(stats, trials, path=None, paths=PATHS):
+    """ plots the sample paths, mean, percentile bands and extremes of a
+    run's balence per hand and saves it to path (.png, .svg, ...), or shows
+    it when path is None
+
+    bands come from the quantile sketch of stats when it has one, otherwise
+    they assume the balence after a given hand is normally distributed with
+    the mean and variance in stats
+    """
+    fig, ax = figure(path)
+    mean = stats.mean
+    std = stats.std()
+    if stats.min is not None:
+        ax.fill_between(*envelope(stats.min, stats.max), color='0.92',
+                label='min/max')
+    for q, z, shade, label in ((5, 1.645, '0.75', '5-95%'),
+            (25, 0.674, '0.6', '25-75%')):
+        if stats.sketch is not None:
+            x, (low, high) = stats.quantiles([q, 100 - q])
+        else:
+            x, low, high = envelope(mean - z*std, mean + z*std)
+        ax.fill_between(x, low, high, color=shade, alpha=0.5, label=label)
+    for balences in stats.samples[:paths]:
+        ax.plot(*decimate(balences), linewidth=0.8)
+    x = envelope(mean, mean)[0]
+    ci95 = std*1.96 # 95% confidence interval
+    ax.plot(x, mean[x], 'k', x, (mean - ci95)[x], 'k--',
+            x, (mean + ci95)[x], 'k--')
+    ax.set_title(str(trials)+' simulated games')
+    ax.set_xlabel('Number of hands played')
+    ax.set_ylabel('Balence')
+    ax.legend(loc='lower left')
+    show(fig, path)
+
+def plot_counts(counts, path=None):
+    """ plots the expected return per unit bet with its 95% confidence
+    interval and the share of hands at each true count of a
+    stats.CountStats, saved to path or shown when path is None """
+    fig, ax = figure(path)
+    seen = counts.hands > 0
+    x = counts.counts[seen]
+    share = ax.twinx()
+    share.bar(x, 100.0*counts.hands[seen]/counts.hands.sum(), color='0.85')
+    share.set_ylabel('Hands (%)')
+    ax.set_zorder(share.get_zorder() + 1)
+    ax.patch.set_visible(False)
+    ax.errorbar(x, 100*counts.mean[seen], yerr=100*counts.ci95()[seen],
+            fmt='ko-', capsize=3)
+    ax.axhline(0, color='k', linewidth=0.5)
+    ax.set_title('Expected return by true count')
+    ax.set_xlabel('True count before the deal')
+    ax.set_ylabel('Return per unit bet (%)')
+    show(fig, path)
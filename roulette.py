@@ -1,23 +1,18 @@
 #!/usr/bin/env python3
-import random, pylab
-
-#set line width
-pylab.rcParams['lines.linewidth'] = 4
-#set font size for titles 
-pylab.rcParams['axes.titlesize'] = 20
-#set font size for labels on axes
-pylab.rcParams['axes.labelsize'] = 20
-#set size of numbers on x-axis
-pylab.rcParams['xtick.labelsize'] = 16
-#set size of numbers on y-axis
-pylab.rcParams['ytick.labelsize'] = 16
-#set size of ticks on x-axis
-pylab.rcParams['xtick.major.size'] = 7
-#set size of ticks on y-axis
-pylab.rcParams['ytick.major.size'] = 7
-#set size of markers, e.g., circles representing points
-#set numpoints for legend
-pylab.rcParams['legend.numpoints'] = 1
+import argparse, random
+import numpy as np
+from multiprocessing import Pool
+from stats import RunningStats
+
+BATCH_SIZE = 1 << 20 # spins drawn at once by the vectorized engine
+RED = (1, 3, 5, 7, 9, 12, 14, 16, 18, 19, 21, 23, 25, 27, 30, 32, 34, 36)
+# outside bets: name -> (numbers covered, odds paid)
+OUTSIDE_BETS = {'red': (RED, 1),
+                'black': (tuple(n for n in range(1, 37) if n not in RED), 1)}
+for i in range(3):
+    OUTSIDE_BETS['dozen ' + str(i + 1)] = (tuple(range(12*i + 1, 12*i + 13)),
+                                           2)
+    OUTSIDE_BETS['column ' + str(i + 1)] = (tuple(range(i + 1, 37, 3)), 2)
 
 class FairRoulette():
     def __init__(self):
@@ -32,6 +27,19 @@ class FairRoulette():
         if str(pocket) == str(self.ball):
             return amt*self.pocketOdds
         else: return -amt
+    def spinCounts(self, numSpins, rng=None, batchSize=BATCH_SIZE):
+        """ returns how often each of self.pockets came up in numSpins
+
+        spins are drawn in NumPy batches of batchSize and histogrammed,
+        rng is a numpy Generator (a fresh one when None)
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        counts = np.zeros(len(self.pockets), dtype=np.int64)
+        for start in range(0, numSpins, batchSize):
+            balls = rng.integers(0, len(self.pockets),
+                                 min(batchSize, numSpins - start))
+            counts += np.bincount(balls, minlength=len(self.pockets))
+        return counts
     def __str__(self):
         return 'Fair Roulette'
 
@@ -46,11 +54,25 @@ def playRoulette(game, numSpins, pocket, bet, toPrint):
               str(100*totPocket/numSpins) + '%\n')
     return (totPocket/numSpins)
 
-random.seed(0)
-game = FairRoulette()
-for numSpins in (100, 1000000):
-    for i in range(3):
-        playRoulette(game, numSpins, 2, 1, True)
+def playAllBets(game, numSpins, rng=None, toPrint=False):
+    """ returns {bet: expected return per unit bet} for every straight up
+    pocket and the outside bets in OUTSIDE_BETS, all from the same
+    numSpins spins of game """
+    counts = game.spinCounts(numSpins, rng)
+    returns = {}
+    for pocket, wins in zip(game.pockets, counts):
+        returns[str(pocket)] = ((wins*game.pocketOdds - (numSpins - wins))
+                                /numSpins)
+    index = dict((str(pocket), i) for i, pocket in enumerate(game.pockets))
+    for bet, (numbers, odds) in OUTSIDE_BETS.items():
+        wins = counts[[index[str(n)] for n in numbers]].sum()
+        returns[bet] = (wins*odds - (numSpins - wins))/numSpins
+    if toPrint:
+        print(numSpins, 'spins of', game)
+        for bet, ret in returns.items():
+            print('Expected return betting', bet, '=',
+                  str(100*ret) + '%')
+    return returns
 
 class EuRoulette(FairRoulette):
     def __init__(self):
@@ -73,27 +95,125 @@ def findPocketReturn(game, numTrials, trialSize, toPrint):
         pocketReturns.append(trialVals)
     return pocketReturns
 
-random.seed(0)
-numTrials = 20
-resultDict = {}
-games = (FairRoulette, EuRoulette, AmRoulette)
-for G in games:
-    resultDict[G().__str__()] = []
-for numSpins in (1000, 10000, 100000, 1000000):
-    print('\nSimulate', numTrials, 'trials of',
-          numSpins, 'spins each')
-    for G in games:
-        pocketReturns = findPocketReturn(G(), numTrials,
-                                         numSpins, False)
-        expReturn = 100*sum(pocketReturns)/len(pocketReturns)
-        print('Exp. return for', G(), '=',
-             str(round(expReturn, 4)) + '%')
-             
+GAMES = (FairRoulette, EuRoulette, AmRoulette)
+SPINS = (1000, 10000, 100000, 1000000)
+NUM_TRIALS = 20
+
 def getMeanAndStd(X):
-    mean = sum(X)/float(len(X))
-    tot = 0.0
+    stats = RunningStats(())
     for x in X:
-        tot += (x - mean)**2
-    std = (tot/len(X))**0.5
-    return mean, std
+        stats.add(x)
+    return float(stats.mean), float(stats.std())
+
+def playTrial(task):
+    """ returns ([bet names], [expected returns]) of one trial, task is
+    (game class, numSpins, seed) """
+    G, numSpins, seed = task
+    returns = playAllBets(G(), numSpins, np.random.default_rng(seed))
+    return list(returns), list(returns.values())
+
+def trialSeed(seed, *key):
+    return np.random.SeedSequence(seed, spawn_key=key)
+
+def runExperiments(games=GAMES, spins=SPINS, numTrials=NUM_TRIALS, seed=None,
+                   workers=None):
+    """ returns {(str(game), numSpins): (bet names, RunningStats of the
+    returns of every bet)} of numTrials trials per game and number of spins
+
+    trials are spread over a pool of workers, each spinning an independent
+    stream spawned from seed
+    """
+    tasks = [(G, numSpins, trialSeed(seed, g, s, t))
+             for g, G in enumerate(games)
+             for s, numSpins in enumerate(spins)
+             for t in range(numTrials)]
+    results = {}
+    with Pool(workers) as pool:
+        for (G, numSpins, _), (bets, returns) in zip(tasks,
+                pool.imap(playTrial, tasks, chunksize=4)):
+            key = (str(G()), numSpins)
+            if key not in results:
+                results[key] = (bets, RunningStats(len(bets)))
+            results[key][1].add(returns)
+    return results
+
+def setupPylab():
+    import pylab
+    #set line width
+    pylab.rcParams['lines.linewidth'] = 4
+    #set font size for titles 
+    pylab.rcParams['axes.titlesize'] = 20
+    #set font size for labels on axes
+    pylab.rcParams['axes.labelsize'] = 20
+    #set size of numbers on x-axis
+    pylab.rcParams['xtick.labelsize'] = 16
+    #set size of numbers on y-axis
+    pylab.rcParams['ytick.labelsize'] = 16
+    #set size of ticks on x-axis
+    pylab.rcParams['xtick.major.size'] = 7
+    #set size of ticks on y-axis
+    pylab.rcParams['ytick.major.size'] = 7
+    #set size of markers, e.g., circles representing points
+    #set numpoints for legend
+    pylab.rcParams['legend.numpoints'] = 1
+    return pylab
+
+def plotReturns(results, bet, fileName=None):
+    """ plots the mean and standard deviation of the return of bet against
+    the number of spins, saved to fileName or shown when it is None """
+    if fileName is not None:
+        import matplotlib
+        matplotlib.use('Agg')
+    pylab = setupPylab()
+    games = []
+    for game, numSpins in results:
+        if game not in games:
+            games.append(game)
+    for game in games:
+        spins = sorted(n for g, n in results if g == game)
+        means, stds = [], []
+        for numSpins in spins:
+            bets, stats = results[(game, numSpins)]
+            means.append(100*stats.mean[bets.index(bet)])
+            stds.append(100*stats.std()[bets.index(bet)])
+        pylab.errorbar(spins, means, yerr=stds, label=game)
+    pylab.semilogx()
+    pylab.title('Expected return betting ' + bet)
+    pylab.xlabel('Number of spins per trial')
+    pylab.ylabel('Return (%)')
+    pylab.legend(loc='best')
+    if fileName is None:
+        pylab.show()
+    else:
+        pylab.savefig(fileName)
+
+def main():
+    parser = argparse.ArgumentParser(description='roulette experiments')
+    parser.add_argument('--trials', type=int, default=NUM_TRIALS)
+    parser.add_argument('--spins', type=int, nargs='+', default=SPINS)
+    parser.add_argument('--bet', default='2',
+                        help='pocket or outside bet to report, e.g. red')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--plot', nargs='?', const='',
+                        help='plot the returns, saved to a file if given')
+    args = parser.parse_args()
+
+    seed = np.random.SeedSequence(args.seed).entropy
+    print('seed:', seed)
+    results = runExperiments(GAMES, args.spins, args.trials, seed,
+                             args.workers)
+    for numSpins in args.spins:
+        print('\nSimulate', args.trials, 'trials of',
+              numSpins, 'spins each')
+        for G in GAMES:
+            bets, stats = results[(str(G()), numSpins)]
+            i = bets.index(args.bet)
+            print('Exp. return for', G(), '=',
+                  str(round(100*stats.mean[i], 4)) + '%, std',
+                  str(round(100*stats.std()[i], 4)) + '%')
+    if args.plot is not None:
+        plotReturns(results, args.bet, args.plot or None)
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Streaming statistics that can be merged across workers
+"""
+import collections, time
+import numpy as np
+
+class QuantileSketch(object):
+    """ Mergeable histograms of chosen indexes of a fixed size vector
+
+    The observations at indexes[k] are counted in BINS fixed bins spread
+    evenly over arcsinh(x/scale[k]) from -LIMIT to LIMIT, about linear near
+    zero and logarithmic further out, with anything beyond in the outer
+    bins. Every worker builds the same bins, so sketches merge exactly by
+    adding their counts, and quantiles are read off the counts to within a
+    bin.
+    """
+    BINS = 255 # odd, so 0 is in the middle of a bin
+    LIMIT = 10.0
+    def __init__(self, indexes, scale=1.0):
+        self.indexes = np.asarray(indexes, dtype=np.intp)
+        self.scale = np.broadcast_to(np.asarray(scale, dtype=float),
+                self.indexes.shape).copy()
+        self.counts = np.zeros((len(self.indexes), self.BINS), dtype=np.int64)
+    def add_batch(self, X):
+        """ count the rows of X """
+        t = np.arcsinh(np.asarray(X, dtype=float)[:, self.indexes]/self.scale)
+        bins = ((t + self.LIMIT)*self.BINS/(2*self.LIMIT)).astype(np.intp)
+        np.clip(bins, 0, self.BINS - 1, out=bins)
+        bins += self.BINS*np.arange(len(self.indexes))
+        self.counts += np.bincount(bins.ravel(),
+                minlength=self.counts.size).reshape(self.counts.shape)
+    def merge(self, other):
+        self.counts += other.counts
+    def quantiles(self, q):
+        """ q-th percentiles at each index, interpolated within a bin """
+        cum = self.counts.cumsum(axis=1)
+        total = np.maximum(cum[:, -1:], 1)
+        out = []
+        for p in np.atleast_1d(q):
+            target = p/100.0*total
+            b = np.minimum((cum < target).sum(axis=1), self.BINS - 1)
+            rows = np.arange(len(b))
+            n = self.counts[rows, b]
+            below = cum[rows, b] - n
+            f = np.clip((target[:, 0] - below)/np.maximum(n, 1), 0, 1)
+            t = (b + f)*2*self.LIMIT/self.BINS - self.LIMIT
+            out.append(np.sinh(t)*self.scale)
+        return np.array(out)
+
+class RunningStats(object):
+    """ Running count, mean and M2 for every index of a fixed size vector
+
+    Observations are folded in with Welford's update and partial results
+    from other workers are combined with Chan's parallel formula, so memory
+    stays O(size) however many observations are seen. Optionally tracks the
+    min/max per index, feeds a QuantileSketch and keeps the first few
+    observation vectors as sample paths to plot.
+    """
+    def __init__(self, size, extrema=False, samples=0, sketch=None):
+        self.count = np.zeros(size, dtype=np.int64)
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+        self.min = np.full(size, np.inf) if extrema else None
+        self.max = np.full(size, -np.inf) if extrema else None
+        self.sketch = sketch
+        self.max_samples = samples
+        self.samples = []
+    def add(self, x):
+        """ fold in one observation vector """
+        x = np.asarray(x, dtype=float)
+        if self.sketch is not None:
+            self.sketch.add_batch(x[None])
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta/self.count
+        self.m2 += delta*(x - self.mean)
+        if self.min is not None:
+            np.minimum(self.min, x, out=self.min)
+            np.maximum(self.max, x, out=self.max)
+        if len(self.samples) < self.max_samples:
+            self.samples.append(x.copy())
+    def add_batch(self, X):
+        """ fold in the rows of X """
+        X = np.asarray(X, dtype=float)
+        if not len(X):
+            return
+        if self.sketch is not None:
+            self.sketch.add_batch(X)
+        batch = RunningStats(X.shape[1:], self.min is not None,
+                self.max_samples - len(self.samples))
+        batch.count[...] = len(X)
+        batch.mean = X.mean(axis=0)
+        batch.m2 = ((X - batch.mean)**2).sum(axis=0)
+        if batch.min is not None:
+            batch.min = X.min(axis=0)
+            batch.max = X.max(axis=0)
+        batch.samples = [x.copy() for x in X[:batch.max_samples]]
+        self.merge(batch)
+    def merge(self, other):
+        """ fold in the observations summarized by other """
+        count = self.count + other.count
+        safe = np.maximum(count, 1)
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta*other.count/safe
+        self.m2 = self.m2 + other.m2 + delta**2*self.count*other.count/safe
+        self.count = count
+        if self.min is not None and other.min is not None:
+            np.minimum(self.min, other.min, out=self.min)
+            np.maximum(self.max, other.max, out=self.max)
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.merge(other.sketch)
+        room = self.max_samples - len(self.samples)
+        self.samples.extend(other.samples[:room])
+    def var(self):
+        """ population variance, like np.var """
+        return self.m2/np.maximum(self.count, 1)
+    def std(self):
+        return np.sqrt(self.var())
+    def quantiles(self, q):
+        """ (indexes, q-th percentiles at them) from the sketch """
+        return self.sketch.indexes, self.sketch.quantiles(q)
+
+class Profile(object):
+    """ Time spent in each phase of a round and counts of game events
+
+    play_round calls lap at the end of every phase while a Profile is
+    attached, and instrument wraps a player's move, double and split to
+    count them. Profiles of different workers add up with merge.
+    """
+    PHASES = ('deal', 'wager', 'player', 'dealer', 'settle', 'clear')
+    def __init__(self):
+        self.times = dict.fromkeys(self.PHASES, 0.0)
+        self.counts = collections.Counter()
+        self.last = 0.0
+    def start(self):
+        self.last = time.perf_counter()
+    def lap(self, phase):
+        """ adds the time since the last lap (or start) to phase """
+        now = time.perf_counter()
+        self.times[phase] += now - self.last
+        self.last = now
+    def count(self, event, n=1):
+        self.counts[event] += n
+    def counted(self, event, method):
+        """ method wrapped to count event on every call """
+        counts = self.counts
+        def wrapper(*args, **kwargs):
+            counts[event] += 1
+            return method(*args, **kwargs)
+        return wrapper
+    def instrument(self, player):
+        """ counts the decisions, doubles and splits of player """
+        player.move = self.counted('decisions', player.move)
+        player.double = self.counted('doubles', player.double)
+        player.split = self.counted('splits', player.split)
+    def tally(self, dealer, players):
+        """ counts the hands, busts and blackjacks of a settled round """
+        for player in players:
+            self.counts['hands'] += 1
+            self.counts['busts'] += player.hard_total > 21
+            if len(player.split_hand):
+                self.counts['busts'] += player.split_hard_total > 21
+            elif player.has_blackjack():
+                self.counts['blackjacks'] += 1
+        self.counts['dealer busts'] += dealer.hard_total > 21
+    def merge(self, other):
+        for phase, seconds in other.times.items():
+            self.times[phase] = self.times.get(phase, 0.0) + seconds
+        self.counts.update(other.counts)
+    def table(self):
+        """ summary of the phase times and event counts per hand """
+        hands = max(self.counts['hands'], 1)
+        total = sum(self.times.values()) or 1.0
+        lines = ['%-14s %10s %7s %10s' % ('phase', 'seconds', '%', 'us/hand')]
+        for phase, seconds in self.times.items():
+            lines.append('%-14s %10.3f %6.1f%% %10.2f' % (phase, seconds,
+                100*seconds/total, 1e6*seconds/hands))
+        lines.append('')
+        lines.append('%-14s %10s %10s' % ('event', 'count', 'per hand'))
+        for event, n in sorted(self.counts.items()):
+            lines.append('%-14s %10d %10.4f' % (event, n, n/float(hands)))
+        return '\n'.join(lines)
+
+class CountStats(object):
+    """ Net result per unit bet and event frequencies by pre-deal true count
+
+    Every hand goes to the bucket of the true count of the cards showing
+    before its deal, rounded and clipped to LOW..HIGH. This is not the
+    count HLPlayer.set_wager bets on: play_round wagers after the deal, so
+    the player's cards and the dealer's upcard are in that count. Each bucket keeps the hand count, the running mean and M2 of
+    the result divided by the round's bet, and how many hands had a
+    blackjack, a bust, a double or a split. Like HandRecorder it is told
+    when a round starts, is played out and is finished, and results of
+    different workers add up with merge.
+    """
+    LOW = -10
+    HIGH = 10
+    EVENTS = ('blackjacks', 'busts', 'doubles', 'splits')
+    def __init__(self):
+        size = self.HIGH - self.LOW + 1
+        self.counts = np.arange(self.LOW, self.HIGH + 1)
+        self.hands = np.zeros(size, dtype=np.int64)
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+        self.events = dict((event, np.zeros(size, dtype=np.int64))
+                for event in self.EVENTS)
+        self.bet = None
+        self.flags = set()
+    def instrument(self, player):
+        """ notes the bet, doubles and splits of player """
+        set_wager = player.set_wager
+        def wager(*args):
+            set_wager(*args)
+            if self.bet is None:
+                self.bet = player.wager
+        player.set_wager = wager
+        for name, event in (('double', 'doubles'), ('split', 'splits')):
+            setattr(player, name, self.flagged(event, getattr(player, name)))
+    def flagged(self, event, method):
+        def wrapper(*args, **kwargs):
+            self.flags.add(event)
+            return method(*args, **kwargs)
+        return wrapper
+    def start(self, player):
+        count = int(round(player.cards_showing.true_count()))
+        self.bucket = min(max(count, self.LOW), self.HIGH) - self.LOW
+        self.balence = player.balence
+        self.bet = None
+        self.flags = set()
+    def played(self, dealer, players):
+        player = players[0]
+        if player.hard_total > 21 or (len(player.split_hand) and
+                player.split_hard_total > 21):
+            self.flags.add('busts')
+        if not len(player.split_hand) and player.has_blackjack():
+            self.flags.add('blackjacks')
+    def finish(self, player):
+        i = self.bucket
+        x = (player.balence - self.balence)/(self.bet or 1)
+        self.hands[i] += 1
+        delta = x - self.mean[i]
+        self.mean[i] += delta/self.hands[i]
+        self.m2[i] += delta*(x - self.mean[i])
+        for event in self.flags:
+            self.events[event][i] += 1
+    def merge(self, other):
+        hands = self.hands + other.hands
+        safe = np.maximum(hands, 1)
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta*other.hands/safe
+        self.m2 = self.m2 + other.m2 + delta**2*self.hands*other.hands/safe
+        self.hands = hands
+        for event in self.EVENTS:
+            self.events[event] = self.events[event] + other.events[event]
+    def std(self):
+        """ standard deviation of the result per unit bet per bucket """
+        return np.sqrt(self.m2/np.maximum(self.hands - 1, 1))
+    def ci95(self):
+        return 1.96*self.std()/np.sqrt(np.maximum(self.hands, 1))
+    def table(self):
+        """ expected return and event frequencies by true count """
+        total = max(self.hands.sum(), 1)
+        lines = ['%5s %10s %6s %9s %8s' % ('tc', 'hands', '%', 'ev %',
+            '+/-95%') + ''.join(' %10s' % event for event in self.EVENTS)]
+        ci95 = self.ci95()
+        for i in np.flatnonzero(self.hands):
+            n = self.hands[i]
+            lines.append('%+5d %10d %5.1f%% %+9.3f %8.3f' % (self.counts[i],
+                n, 100.0*n/total, 100*self.mean[i], 100*ci95[i]) +
+                ''.join(' %9.2f%%' % (100.0*self.events[event][i]/n)
+                    for event in self.EVENTS))
+        return '\n'.join(lines)
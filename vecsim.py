@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Lockstep vectorized blackjack engine
+
+Plays many independent trials at once. Every shoe and hand is an integer
+NumPy array with one row per trial, and all rows advance together through
+the deal, player decisions, dealer draws and settlement using masked array
+operations. The table rules are the ones mc21.simulate_trial plays.
+"""
+import numpy as np
+from blackjack import VALS, Status, Action, HandClass, Player, UIPlayer
+from blackjack import BasicStratPlayer, ROUND_CARDS, compile_table
+
+# card codes are indexes into VALS
+HARD_VALS = np.array([1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10])
+UP_VALS = np.array([11, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10])
+
+class VecShoes(object):
+    """ One shoe per row dealt by advancing a per row cursor
+
+    Works like blackjack.Shoe: the cut card is a position and reaching it
+    shuffles every card that is not on the table back in.
+    """
+    def __init__(self, rows, decks, penetration, rng):
+        codes = np.repeat(np.arange(len(VALS), dtype=np.int8), 4*decks)
+        self.cards = np.tile(codes, (rows, 1))
+        self.size = len(codes)
+        self.penetration = penetration
+        self.rng = rng
+        self.pos = np.zeros(rows, dtype=np.intp)
+        self.cut = np.zeros(rows, dtype=np.intp)
+        self.round_start = np.zeros(rows, dtype=np.intp)
+        self.shuffle(np.arange(rows))
+    def shuffle(self, rows):
+        keys = self.rng.random((len(rows), self.size))
+        idx = np.arange(self.size)
+        in_play = ((idx >= self.round_start[rows, None]) &
+                (idx < self.pos[rows, None]))
+        keys[in_play] = -1.0
+        order = np.argsort(keys, axis=1)
+        self.cards[rows] = np.take_along_axis(self.cards[rows], order, axis=1)
+        self.pos[rows] -= self.round_start[rows]
+        self.round_start[rows] = 0
+        cut = (int(self.size*self.penetration) - 8 +
+                self.rng.integers(-4, 5, len(rows)))
+        self.cut[rows] = np.minimum(np.maximum(cut,
+            self.pos[rows] + ROUND_CARDS), self.size)
+    def deal(self, rows):
+        late = self.pos[rows] >= self.cut[rows]
+        if late.any():
+            self.shuffle(rows[late])
+        codes = self.cards[rows, self.pos[rows]]
+        self.pos[rows] += 1
+        return codes
+    def end_round(self):
+        self.round_start[:] = self.pos
+
+def best_hand_vals(hard, aces):
+    """ vectorized Player.best_hand_val """
+    soft = hard + 10*aces
+    return np.where(hard > 21, 0, np.where(soft <= 21, soft, hard))
+
+def simulate_trials(num_trials, num_hands, player_cls=BasicStratPlayer,
+        decks=8, penetration=1.0, seed=None, table=None, out=None):
+    """ returns the (num_trials, num_hands) balence log matrix
+
+    player_cls must be a flat betting strategy player; its move is compiled
+    into a lookup table (see blackjack.compile_table) once and played for
+    every row at the same time. A strategy table given as table is played
+    instead. The balences are written into out when it is given.
+    """
+    if table is None:
+        if (player_cls.set_wager is not Player.set_wager or
+                issubclass(player_cls, UIPlayer)):
+            raise ValueError('only flat betting strategy players can be '
+                    'vectorized', player_cls)
+        table = compile_table(player_cls)
+    table = np.array(table, dtype=np.int8)
+    rng = np.random.default_rng(seed)
+    shoes = VecShoes(num_trials, decks, penetration, rng)
+    everyone = np.arange(num_trials)
+    balence = np.zeros(num_trials)
+    if out is None:
+        out = np.empty((num_trials, num_hands))
+    balence_log = out
+    for j in range(num_hands):
+        shoes.end_round()
+        up_card = shoes.deal(everyone)
+        first = shoes.deal(everyone)
+        hole_card = shoes.deal(everyone)
+        second = shoes.deal(everyone)
+        balence_log[:, j] = balence
+
+        # two hand slots per row, the second one is only used after a split
+        hard = np.zeros((num_trials, 2), dtype=np.intp)
+        aces = np.zeros((num_trials, 2), dtype=np.intp)
+        num_cards = np.zeros((num_trials, 2), dtype=np.intp)
+        hard[:, 0] = HARD_VALS[first] + HARD_VALS[second]
+        aces[:, 0] = (first == 0).astype(np.intp) + (second == 0)
+        num_cards[:, 0] = 2
+        wager = np.ones((num_trials, 2))
+        status = np.full(num_trials, Status.PLAY, dtype=np.intp)
+        cur = np.zeros(num_trials, dtype=np.intp)
+        split = np.zeros(num_trials, dtype=bool)
+        up = UP_VALS[up_card]
+        pair_total = UP_VALS[first]
+        same_val = first == second
+
+        # player loop
+        rows = everyone
+        while len(rows):
+            slot = cur[rows]
+            h = hard[rows, slot]
+            pair = (same_val[rows] & (status[rows] == Status.PLAY) &
+                    (num_cards[rows, 0] == 2))
+            hand_class = np.where(pair, HandClass.PAIR,
+                    np.minimum(aces[rows, slot], 2))
+            total = np.where(pair, pair_total[rows], np.minimum(h, 21))
+            action = table[hand_class, total, up[rows]]
+            action[h > 21] = Action.STAND
+
+            doubled = rows[action == Action.DOUBLE]
+            wager[doubled, cur[doubled]] *= 2
+            drawing = rows[(action == Action.HIT) |
+                    (action == Action.DOUBLE)]
+            if len(drawing):
+                card = shoes.deal(drawing)
+                slot = cur[drawing]
+                hard[drawing, slot] += HARD_VALS[card]
+                aces[drawing, slot] += card == 0
+                num_cards[drawing, slot] += 1
+
+            splitting = rows[action == Action.SPLIT]
+            if len(splitting):
+                card = second[splitting]
+                hard[splitting, 0] -= HARD_VALS[card]
+                aces[splitting, 0] -= card == 0
+                hard[splitting, 1] = HARD_VALS[card]
+                aces[splitting, 1] = card == 0
+                num_cards[splitting] = 1
+                wager[splitting, 1] = wager[splitting, 0]
+                status[splitting] = Status.SPLIT_1
+                split[splitting] = True
+
+            standing = rows[(action == Action.STAND) |
+                    (action == Action.DOUBLE)]
+            to_second = standing[status[standing] == Status.SPLIT_1]
+            cur[to_second] = 1
+            status[standing] = Status.STAND
+            status[to_second] = Status.SPLIT_2
+            rows = np.flatnonzero(status != Status.STAND)
+
+        # dealer loop
+        d_hard = HARD_VALS[up_card] + HARD_VALS[hole_card]
+        d_aces = (up_card == 0).astype(np.intp) + (hole_card == 0)
+        d_num_cards = np.full(num_trials, 2)
+        while True:
+            d_best = best_hand_vals(d_hard, d_aces)
+            rows = np.flatnonzero((d_best > 0) & (d_best < 17))
+            if not len(rows):
+                break
+            card = shoes.deal(rows)
+            d_hard[rows] += HARD_VALS[card]
+            d_aces[rows] += card == 0
+            d_num_cards[rows] += 1
+
+        # eval hands
+        d_blackjack = (d_hard + 10*d_aces == 21) & (d_num_cards == 2)
+        p_best = best_hand_vals(hard, aces)
+        d_best = d_best[:, None]
+        split_net = np.select(
+                [p_best <= 0, p_best > d_best, p_best < d_best],
+                [-wager, wager, -wager]).sum(axis=1)
+        p_blackjack = ((hard[:, 0] + 10*aces[:, 0] == 21) &
+                (num_cards[:, 0] == 2))
+        p_best, d_best, bet = p_best[:, 0], d_best[:, 0], wager[:, 0]
+        net = np.select(
+                [p_best <= 0, p_blackjack & ~d_blackjack,
+                    ~p_blackjack & d_blackjack, p_best > d_best,
+                    p_best < d_best],
+                [-bet, 1.5*bet, -bet, bet, -bet])
+        balence += np.where(split, split_net, net)
+    return balence_log